@@ -33,7 +33,7 @@ from sugar3 import mime
 from sugar3 import profile
 
 from toolbar_utils import button_factory, label_factory, separator_factory, \
-    radio_factory, entry_factory
+    radio_factory, entry_factory, combo_factory, toggle_factory
 from utils import json_load, json_dump, get_hardware, \
     pixbuf_to_base64, base64_to_pixbuf
 
@@ -45,6 +45,7 @@ except (ImportError, ModuleNotFoundError):
 from gettext import gettext as _
 
 from chess import Gnuchess
+from game import STRENGTHS, MODE_STRENGTHS
 
 import logging
 
@@ -72,6 +73,8 @@ class GNUChessActivity(activity.Activity):
         self.game_data = None
         self.playing_white = True
         self.playing_mode = 'easy'
+        self.strength = MODE_STRENGTHS['easy']
+        self.ponder = False  # think on the human's time
         self.playing_robot = True
         self.showing_game_history = False
         self._restoring = True
@@ -103,10 +106,13 @@ class GNUChessActivity(activity.Activity):
         self._gnuchess = Gnuchess(canvas,
                                   parent=self,
                                   path=activity.get_bundle_path(),
-                                  colors=self.colors)
+                                  colors=self.colors,
+                                  data_path='%s/data' % (
+                                      activity.get_activity_root()))
 
         self.connect('shared', self._shared_cb)
         self.connect('joined', self._joined_cb)
+        self.connect('destroy', self._destroy_cb)
         self._restoring = False
 
         self.collab = CollabWrapper(self)
@@ -125,6 +131,10 @@ class GNUChessActivity(activity.Activity):
         else:
             self._gnuchess.new_game()
 
+    def _destroy_cb(self, widget):
+        ''' Stop the gnuchess session along with the activity. '''
+        self._gnuchess.close()
+
     def set_data(self, data):
         pass
 
@@ -292,6 +302,17 @@ class GNUChessActivity(activity.Activity):
 
         self.easy_button.set_active(True)
 
+        self.strength_combo = combo_factory(
+            [strength[0] for strength in STRENGTHS],
+            self.adjust_toolbar,
+            self._strength_cb,
+            tooltip=_('Strength'),
+            default=STRENGTHS[self.strength][0])
+
+        self.ponder_button = toggle_factory('ponder', self._ponder_cb,
+                                            self.adjust_toolbar,
+                                            tooltip=_('Think on my time'))
+
         separator_factory(self.adjust_toolbar, False, True)
 
         self.robot_button = radio_factory('robot',
@@ -563,6 +584,40 @@ class GNUChessActivity(activity.Activity):
             self._new_game_alert('hard')
         return True
 
+    def _strength_cb(self, combo):
+        ''' The strength can change at any time: it applies from the
+        robot's next move. The easy and hard buttons follow along. '''
+        strength = combo.get_active()
+        if strength < 0 or strength == self.strength:
+            return
+        self.strength = strength
+        if strength < len(STRENGTHS) // 2:
+            mode = 'easy'
+        else:
+            mode = 'hard'
+        if mode != self.playing_mode:
+            self.playing_mode = mode
+            restoring = self._restoring
+            self._restoring = True
+            if mode == 'easy':
+                self.easy_button.set_active(True)
+            else:
+                self.hard_button.set_active(True)
+            self._restoring = restoring
+        return True
+
+    def _ponder_cb(self, button):
+        ''' Pondering keeps gnuchess busy while the human thinks, so it
+        is left to the player to turn on. It applies from the next
+        move. '''
+        self.ponder = button.get_active()
+
+    def _set_strength(self, strength):
+        ''' Move the robot (and the strength combo) to a rung of the
+        ladder '''
+        self.strength = strength
+        self.strength_combo.set_active(strength)
+
     def _robot_cb(self, *args):
         if not self.robot_button.get_active():
             return
@@ -594,7 +649,7 @@ class GNUChessActivity(activity.Activity):
         if self.playing_white:
             white = nick
             if self.playing_robot:
-                black = 'gnuchess (%s)' % (self.playing_mode)
+                black = 'gnuchess (%s)' % (STRENGTHS[self.strength][0])
             elif self._gnuchess.we_are_sharing and buddy is not None:
                 black = buddy
             else:
@@ -602,7 +657,7 @@ class GNUChessActivity(activity.Activity):
         else:
             black = nick
             if self.playing_robot:
-                white = 'gnuchess (%s)' % (self.playing_mode)
+                white = 'gnuchess (%s)' % (STRENGTHS[self.strength][0])
             elif self._gnuchess.we_are_sharing and buddy is not None:
                 white = buddy
             else:
@@ -621,6 +676,8 @@ class GNUChessActivity(activity.Activity):
         else:
             self.metadata['playing_white'] = 'False'
         self.metadata['playing_mode'] = self.playing_mode
+        self.metadata['strength'] = str(self.strength)
+        self.metadata['ponder'] = str(self.ponder)
         if self.playing_robot:
             self.metadata['playing_robot'] = 'True'
         else:
@@ -647,6 +704,18 @@ class GNUChessActivity(activity.Activity):
             self.playing_mode = self.metadata['playing_mode']
             if self.playing_mode == 'hard':
                 self.hard_button.set_active(True)
+            self._set_strength(MODE_STRENGTHS.get(self.playing_mode, 0))
+        if 'strength' in self.metadata:
+            try:
+                strength = int(self.metadata['strength'])
+            except ValueError:
+                strength = -1
+            if strength >= 0 and strength < len(STRENGTHS):
+                self._set_strength(strength)
+        if 'ponder' in self.metadata:
+            if self.metadata['ponder'] == 'True':
+                self.ponder = True
+                self.ponder_button.set_active(True)
         if 'playing_robot' in self.metadata:
             if self.metadata['playing_robot'] == 'False':
                 self.playing_robot = False
@@ -701,8 +770,10 @@ class GNUChessActivity(activity.Activity):
             self.playing_white = True
         elif button == 'easy':
             self.playing_mode = 'easy'
+            self._set_strength(MODE_STRENGTHS['easy'])
         elif button == 'hard':
             self.playing_mode = 'hard'
+            self._set_strength(MODE_STRENGTHS['hard'])
         elif button == 'robot':
             self.playing_robot = True
         elif button == 'human':
@@ -785,6 +856,7 @@ class GNUChessActivity(activity.Activity):
 
         self.easy_button.set_sensitive(False)
         self.hard_button.set_sensitive(False)
+        self.strength_combo.set_sensitive(False)
         self.robot_button.set_sensitive(False)
 
     def _setup_dispatch_table(self):
@@ -837,6 +909,8 @@ class GNUChessActivity(activity.Activity):
         def _alert_response_cb(alert, response_id):
             self.remove_alert(alert)
 
+        self._gnuchess.time_up()
+
         alert = NotifyAlert()
         alert.props.title = _('Time Up!')
         alert.props.msg = _('Your time is up.')
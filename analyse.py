@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+'''
+analyse.py has gnuchess look over saved games: every position is
+searched, and each move is printed with the evaluation before it, the
+move gnuchess would have played and how much the move lost, with ?
+for mistakes and ?? for blunders. The positions are shared among a
+pool of worker processes, each with its own gnuchess session, and the
+moves are printed as soon as both positions around them are done.
+
+It reads PGN, and the games the activity keeps in the Journal (tag
+pairs followed by the game record gnuchess prints).
+
+    python3 analyse.py [-j JOBS] [-d DEPTH] FILE|DIRECTORY ...
+    python3 analyse.py --scaling [-j JOBS] FILE|DIRECTORY ...
+
+With --scaling, the positions are searched with 1, 2, ... JOBS workers
+and the positions/second of each is reported instead.
+'''
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from engine import EngineSession, CancelToken, find_binary, \
+    MOVE, VARIATION, time_control
+from board import Board
+from movegen import Position
+
+MATE = 10000  # centipawns for a mate, and the most a move can lose
+MISTAKE = 100  # centipawns lost
+BLUNDER = 300
+TOKEN = re.compile(r'\{[^}]*\}|\([^)]*\)|\S+')
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+NOT_MOVES = ['White', 'Black', '1-0', '0-1', '1/2-1/2', '*']
+
+_session = None  # each worker's gnuchess session
+_depth = None  # and its search depth and seconds per position
+_seconds = None
+
+
+def read_games(path):
+    ''' The games (lists of SAN moves) in a file. A game ends at the
+    first token that is not a move that can be played. '''
+    games = []
+    moves = None
+    board = None
+    in_moves = False
+    with open(path, errors='replace') as fd:
+        for line in fd:
+            line = line.strip()
+            if line.startswith('['):
+                if in_moves or moves is None:
+                    moves = []
+                    board = Board()
+                    games.append(moves)
+                    in_moves = False
+                continue
+            if moves is None:
+                moves = []
+                board = Board()
+                games.append(moves)
+            for token in TOKEN.findall(line):
+                token = MOVE_NUMBER.sub('', token)
+                if token == '' or token in NOT_MOVES or token[0] in '{(;$':
+                    continue
+                in_moves = True
+                if board is None:
+                    continue  # this game has ended
+                try:
+                    board.push(token)
+                    moves.append(token)
+                except ValueError:
+                    board = None
+    return [game for game in games if len(game) > 0]
+
+
+def find_games(paths):
+    ''' (file name, game number, moves) for each game in the files and
+    the directories (searched for files) '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files += [os.path.join(root, name) for name in sorted(names)]
+        else:
+            files.append(path)
+    games = []
+    for path in files:
+        for i, moves in enumerate(read_games(path)):
+            games.append((path, i + 1, moves))
+    return games
+
+
+def _start_worker(binary, depth, seconds):
+    global _session, _depth, _seconds
+    _session = EngineSession(binary)
+    _session.start()
+    # 'post' prints the principal variation and its score; the opening
+    # book would play without them.
+    _session.command('post\neasy\nbook off')
+    _depth = depth
+    _seconds = seconds
+
+
+def evaluate(job):
+    ''' Search the position after moves. Return the job's key, the
+    score for the side to move and the best move (None if the game is
+    over). '''
+    key, moves = job
+    _session.sync(moves)
+    level = time_control(_seconds, len(moves)) + 'depth %d\n' % (_depth)
+    events = _session.think(level, keep=False,
+                            token=CancelToken(timeout=_seconds))
+    score = None
+    best = None
+    for kind, value in events:
+        if kind == VARIATION:
+            score = value[1]
+        elif kind == MOVE:
+            best = value
+    if best is None:  # the game is over, or gnuchess will not play on
+        board = Board()
+        board.sync(moves)
+        position = Position.from_board(board)
+        if len(position.legal_moves()) == 0 and position.in_check():
+            score = -MATE
+        else:
+            score = 0
+    elif score is None:  # played without a search
+        score = MATE if best.endswith('#') else 0
+    return key, max(-MATE, min(MATE, score)), best
+
+
+def _jobs(games):
+    jobs = []
+    for g, (path, number, moves) in enumerate(games):
+        for ply in range(len(moves) + 1):
+            jobs.append(((g, ply), moves[:ply]))
+    return jobs
+
+
+def _move_line(game, ply, before, after):
+    ''' A line of analysis for one move: before and after are the
+    (score, best move) of the positions either side of it '''
+    path, number, moves = game
+    score, best = before
+    # What the move lost, as seen by the side that played it. The two
+    # searches differ in depth by a ply, so gnuchess's own choice may
+    # seem to lose a little; it loses nothing.
+    loss = max(0, min(MATE, score + after[0]))
+    if best is not None and best.rstrip('+#') == moves[ply].rstrip('+#'):
+        loss = 0
+    if loss >= BLUNDER:
+        flag = '??'
+    elif loss >= MISTAKE:
+        flag = '?'
+    else:
+        flag = ''
+    white_score = score if ply % 2 == 0 else -score
+    label = '%d.%s' % (ply // 2 + 1, '' if ply % 2 == 0 else '..')
+    return '%s\t%d\t%s\t%s%s\t%+d\t%s\t%d' % (
+        os.path.basename(path), number, label, moves[ply], flag,
+        white_score, best or '-', loss)
+
+
+def analyse(games, jobs, depth, seconds, binary=None, out=sys.stdout):
+    ''' Analyse games, writing a line for each move as soon as it is
+    done; return the number of positions and the seconds taken '''
+    work = _jobs(games)
+    results = {}
+    start = time.time()
+    pool = multiprocessing.Pool(jobs, _start_worker,
+                                (binary or find_binary(), depth, seconds))
+    try:
+        for key, score, best in pool.imap(evaluate, work):
+            results[key] = (score, best)
+            g, ply = key
+            if ply == 0:
+                continue
+            before = results.pop((g, ply - 1))
+            if out is not None:
+                out.write(_move_line(games[g], ply - 1, before,
+                                     results[key]) + '\n')
+                out.flush()
+    finally:
+        pool.close()
+        pool.join()
+    return len(work), time.time() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0], description='Analyse saved games with gnuchess.')
+    parser.add_argument('paths', nargs='+', metavar='FILE')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('-d', '--depth', type=int, default=4)
+    parser.add_argument('-t', '--seconds', type=float, default=2,
+                        help='most time for a position')
+    parser.add_argument('--scaling', action='store_true',
+                        help='measure positions/second on 1..JOBS workers')
+    parser.add_argument('--engine')
+    args = parser.parse_args(argv[1:])
+    games = find_games(args.paths)
+    if len(games) == 0:
+        print('no games found')
+        return 1
+    jobs = max(1, args.jobs)
+    if args.scaling:
+        base = None
+        for n in range(1, jobs + 1):
+            positions, elapsed = analyse(games, n, args.depth, args.seconds,
+                                         args.engine, None)
+            rate = positions / max(elapsed, 1e-9)
+            if base is None:
+                base = rate
+            print('%2d workers: %d positions in %.2fs, %.1f positions/s, '
+                  '%.2fx' % (n, positions, elapsed, rate, rate / base))
+        return 0
+    sys.stdout.write('file\tgame\tmove\tplayed\teval\tbest\tloss\n')
+    positions, elapsed = analyse(games, jobs, args.depth, args.seconds,
+                                 args.engine)
+    sys.stderr.write('%d games, %d positions in %.2fs: %.1f positions/s '
+                     'on %d workers\n' % (len(games), positions, elapsed,
+                                          positions / max(elapsed, 1e-9),
+                                          jobs))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
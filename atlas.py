@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+from gi.repository import GdkPixbuf, GLib
+import json
+import os
+from collections import OrderedDict
+
+import logging
+_logger = logging.getLogger('GNUChessActivity')
+
+VERSION = 1
+COLUMNS = 12  # pieces in a row of the atlas: a whole skin
+CELLS = 96  # pieces kept
+
+
+class PieceAtlas():
+    ''' Pieces already drawn, packed into a single PNG so that a skin
+    is loaded with one file instead of drawn again from its SVGs. Each
+    piece is found by its key: (piece, size, colours, modification
+    time of the file it was drawn from), so a piece drawn at another
+    size or from a changed file is simply not found. The index of the
+    atlas is kept in the PNG itself, as a text chunk, so the two are
+    always written together. The pieces used least recently are
+    dropped first. '''
+
+    def __init__(self, path=None, cells=CELLS):
+        self._path = path
+        self._cells = cells
+        self._pieces = OrderedDict()  # key -> pixbuf
+        self._changed = False
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._pieces)
+
+    def _load(self):
+        try:
+            atlas = GdkPixbuf.Pixbuf.new_from_file(self._path)
+            index = json.loads(atlas.get_option('tEXt::index'))
+        except (GLib.Error, TypeError, ValueError) as e:
+            _logger.debug('cannot read the piece atlas %s: %s' %
+                          (self._path, e))
+            return
+        if index.get('version') != VERSION:
+            return
+        for key, x, y, w, h in index['pieces']:
+            if x + w <= atlas.get_width() and y + h <= atlas.get_height():
+                self._pieces[tuple(key)] = atlas.new_subpixbuf(x, y, w, h)
+
+    def get(self, key):
+        ''' The pixbuf stored for key, or None '''
+        if key not in self._pieces:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pieces.move_to_end(key)
+        return self._pieces[key]
+
+    def put(self, key, pixbuf):
+        self._pieces[key] = pixbuf
+        self._pieces.move_to_end(key)
+        while len(self._pieces) > self._cells:
+            self._pieces.popitem(last=False)
+        self._changed = True
+
+    def save(self):
+        ''' Write the atlas, if pieces have been added to it '''
+        if self._path is None or not self._changed or len(self) == 0:
+            return
+        pieces = list(self._pieces.items())
+        rows = [pieces[i:i + COLUMNS] for i in range(0, len(pieces),
+                                                       COLUMNS)]
+        width = max([sum([pixbuf.get_width() for key, pixbuf in row])
+                     for row in rows])
+        height = sum([max([pixbuf.get_height() for key, pixbuf in row])
+                      for row in rows])
+        atlas = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8,
+                                     width, height)
+        atlas.fill(0)
+        index = []
+        y = 0
+        for row in rows:
+            x = 0
+            for key, pixbuf in row:
+                if not pixbuf.get_has_alpha():
+                    pixbuf = pixbuf.add_alpha(False, 0, 0, 0)
+                w = pixbuf.get_width()
+                h = pixbuf.get_height()
+                pixbuf.copy_area(0, 0, w, h, atlas, x, y)
+                index.append([list(key), x, y, w, h])
+                x += w
+            y += max([pixbuf.get_height() for key, pixbuf in row])
+        # Written aside and renamed, so that another activity reading
+        # the atlas never finds half of it.
+        tmp_path = '%s.%d' % (self._path, os.getpid())
+        try:
+            atlas.savev(tmp_path, 'png', ['tEXt::index'],
+                        [json.dumps({'version': VERSION, 'pieces': index})])
+            os.rename(tmp_path, self._path)
+        except (GLib.Error, OSError) as e:
+            _logger.debug('cannot write the piece atlas %s: %s' %
+                          (self._path, e))
+            return
+        self._changed = False
+        _logger.debug('piece atlas: %d pieces, %d hits, %d misses' %
+                      (len(self), self.hits, self.misses))
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+'''
+board.py follows the game in-process, so the activity can know where
+every piece is without asking gnuchess to print the board.
+
+Squares are numbered as on the screen: 0 is a8, 7 is h8, 56 is a1 and
+63 is h1. Each square holds a gnuchess piece letter ('PRNBQK' for White,
+'prnbqk' for Black) or EMPTY.
+
+Each position also has a Zobrist hash, kept up to date as moves are
+made and taken back, which identifies it (with the side to move,
+castling rights and en passant square) in caches of engine results.
+'''
+
+import random
+
+EMPTY = '.'
+FILES = 'abcdefgh'
+RANKS = '12345678'
+START = 'rnbqkbnr' + 'p' * 8 + EMPTY * 32 + 'P' * 8 + 'RNBQKBNR'
+# Castling: king from, king to, rook from, rook to, right lost
+CASTLES = {'K': (60, 62, 63, 61), 'Q': (60, 58, 56, 59),
+           'k': (4, 6, 7, 5), 'q': (4, 2, 0, 3)}
+
+
+def _zobrist_keys():
+    ''' Fixed random numbers for each piece on each square, each castling
+    right, each en passant file and Black to move. The seed is fixed so
+    that hashes can be kept from one run to the next. '''
+    rand = random.Random(0x5ca1ab1e)
+    pieces = {}
+    for piece in 'PRNBQKprnbqk':
+        pieces[piece] = [rand.getrandbits(64) for i in range(64)]
+    castling = dict([(side, rand.getrandbits(64)) for side in 'KQkq'])
+    ep = [rand.getrandbits(64) for i in range(8)]
+    return pieces, castling, ep, rand.getrandbits(64)
+
+
+ZOBRIST_PIECES, ZOBRIST_CASTLING, ZOBRIST_EP, ZOBRIST_BLACK = \
+    _zobrist_keys()
+
+
+def zobrist(squares, white_to_move, castling, ep):
+    ''' The Zobrist hash of a position, worked out from scratch '''
+    h = 0
+    for i, piece in enumerate(squares):
+        if piece != EMPTY:
+            h ^= ZOBRIST_PIECES[piece][i]
+    for side in castling:
+        h ^= ZOBRIST_CASTLING[side]
+    if ep is not None:
+        h ^= ZOBRIST_EP[ep % 8]
+    if not white_to_move:
+        h ^= ZOBRIST_BLACK
+    return h
+
+
+def square(name):
+    ''' 'e4' -> 36 '''
+    return FILES.index(name[0]) + 8 * (7 - RANKS.index(name[1]))
+
+
+def square_name(i):
+    ''' 36 -> 'e4' '''
+    return '%s%s' % (FILES[i % 8], RANKS[7 - i // 8])
+
+
+def is_white(piece):
+    return piece in 'PRNBQK'
+
+
+class Board():
+    ''' A chess position and the moves that led to it '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        ''' Set up the starting position. '''
+        self.squares = list(START)
+        self.white_to_move = True
+        self.castling = 'KQkq'
+        self.ep = None  # square a pawn may capture en passant
+        self.hash = zobrist(self.squares, True, self.castling, None)
+        self.moves = []
+        self._history = []
+
+    def copy(self):
+        board = Board()
+        board.squares = self.squares[:]
+        board.white_to_move = self.white_to_move
+        board.castling = self.castling
+        board.ep = self.ep
+        board.hash = self.hash
+        board.moves = self.moves[:]
+        board._history = self._history[:]
+        return board
+
+    def sync(self, move_list):
+        ''' Bring the board to the position after move_list, replaying
+        only the moves that differ. '''
+        n = 0
+        for a, b in zip(self.moves, move_list):
+            if a != b:
+                break
+            n += 1
+        while len(self.moves) > n:
+            self.pop()
+        for move in move_list[n:]:
+            self.push(move)
+
+    def push(self, move):
+        ''' Play a move given in SAN (as gnuchess prints it) or in
+        coordinates (as dragged on the screen, e.g. e2e4 or e7e8Q).
+        Raises ValueError if the move cannot be played here. '''
+        frm, to, promotion = self.parse(move)
+        self._history.append((self.squares[:], self.white_to_move,
+                              self.castling, self.ep, self.hash))
+        self.moves.append(move)
+        self._apply(frm, to, promotion)
+        return frm, to
+
+    def pop(self):
+        ''' Take back the last move. '''
+        self.squares, self.white_to_move, self.castling, self.ep, \
+            self.hash = self._history.pop()
+        return self.moves.pop()
+
+    def parse(self, move):
+        ''' Return the from square, to square and promotion piece (or
+        None) of a move in SAN or coordinates. '''
+        move = move.rstrip('+#!?')
+        if len(move) in [4, 5] and move[0] in FILES and move[1] in RANKS \
+           and move[2] in FILES and move[3] in RANKS:
+            promotion = None
+            if len(move) == 5:
+                promotion = move[4].upper()
+            return square(move[:2]), square(move[2:4]), promotion
+        # movegen needs Board, so it cannot be imported before it
+        from movegen import Position
+        return Position.from_board(self).parse_san(move)
+
+    def _put(self, i, piece):
+        ''' Set square i, keeping the hash up to date '''
+        if self.squares[i] != EMPTY:
+            self.hash ^= ZOBRIST_PIECES[self.squares[i]][i]
+        if piece != EMPTY:
+            self.hash ^= ZOBRIST_PIECES[piece][i]
+        self.squares[i] = piece
+
+    def _apply(self, frm, to, promotion):
+        piece = self.squares[frm]
+        white = is_white(piece)
+        if self.ep is not None:
+            self.hash ^= ZOBRIST_EP[self.ep % 8]
+        for side in self.castling:
+            self.hash ^= ZOBRIST_CASTLING[side]
+        if piece in 'Pp':
+            if to == self.ep:  # take the pawn that passed
+                self._put(to + (8 if white else -8), EMPTY)
+            if to < 8 or to > 55:
+                if promotion is None:
+                    promotion = 'Q'
+                piece = promotion.upper() if white else promotion.lower()
+        if piece in 'Kk' and abs(to - frm) == 2:  # castle
+            for side in ['K', 'Q'] if white else ['k', 'q']:
+                if CASTLES[side][1] == to:
+                    rook_from, rook_to = CASTLES[side][2:]
+                    self._put(rook_to, self.squares[rook_from])
+                    self._put(rook_from, EMPTY)
+        self._put(to, piece)
+        self._put(frm, EMPTY)
+        if piece in 'Pp' and abs(to - frm) == 16:
+            self.ep = (to + frm) // 2
+        else:
+            self.ep = None
+        for side in 'KQkq':
+            if side in self.castling and \
+               (frm in [CASTLES[side][0], CASTLES[side][2]] or
+                to == CASTLES[side][2]):
+                self.castling = self.castling.replace(side, '')
+        for side in self.castling:
+            self.hash ^= ZOBRIST_CASTLING[side]
+        if self.ep is not None:
+            self.hash ^= ZOBRIST_EP[self.ep % 8]
+        self.hash ^= ZOBRIST_BLACK
+        self.white_to_move = not self.white_to_move
+
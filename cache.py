@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+import fcntl
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+
+import logging
+_logger = logging.getLogger('GNUChessActivity')
+
+MAGIC = b'gnuchess cache 1'
+HEADER = struct.Struct('<16sII')  # magic, number of slots, clock
+SLOT = struct.Struct('<QIIH')  # hash, level, last used (0: empty), length
+SLOT_SIZE = 128  # slot header and value
+PROBES = 8  # slots a key may occupy
+
+
+class PositionCache():
+    ''' What gnuchess answered in recently seen positions, keyed by
+    Zobrist hash (and anything else the answer depends on). The least
+    recently used entries are forgotten first. '''
+
+    def __init__(self, size=512):
+        self._size = size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        ''' The answer stored for key, or None '''
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class DiskCache():
+    ''' What gnuchess answered, kept in a memory-mapped file so that it
+    outlives the activity. The file has a fixed number of slots, so it
+    never grows: each key may live in any of a few slots after the one
+    its hash picks, and when they are all taken the least recently used
+    is overwritten. Keys are (Zobrist hash, level) pairs and values are
+    short byte strings. '''
+
+    def __init__(self, path, slots=4096):
+        self.hits = 0
+        self.misses = 0
+        self._slots = slots
+        size = HEADER.size + slots * SLOT_SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            header = os.read(self._fd, HEADER.size)
+            if len(header) < HEADER.size or \
+               HEADER.unpack(header)[:2] != (MAGIC, slots) or \
+               os.fstat(self._fd).st_size != size:
+                _logger.debug('starting a new position cache in %s' % (path))
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, HEADER.pack(MAGIC, slots, 0))
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(self._fd, size)
+        except (OSError, ValueError):
+            os.close(self._fd)
+            raise
+
+    def close(self):
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        os.close(self._fd)
+
+    def _tick(self):
+        ''' Advance the clock used to tell which slot was used last '''
+        magic, slots, clock = HEADER.unpack_from(self._map, 0)
+        clock = (clock + 1) & 0xffffffff
+        HEADER.pack_into(self._map, 0, magic, slots, clock)
+        return clock
+
+    def _find(self, h, level):
+        ''' The offset of the slot holding the key, or of the one to
+        overwrite, and whether the key was found '''
+        start = h % self._slots
+        oldest = None
+        for p in range(PROBES):
+            offset = HEADER.size + ((start + p) % self._slots) * SLOT_SIZE
+            slot_hash, slot_level, stamp, length = \
+                SLOT.unpack_from(self._map, offset)
+            if stamp != 0 and slot_hash == h and slot_level == level:
+                return offset, True
+            if oldest is None or stamp < oldest[1]:
+                oldest = (offset, stamp)
+        return oldest[0], False
+
+    def get(self, key):
+        ''' The value stored for key, or None '''
+        if self._map is None:
+            return None
+        h, level = _disk_key(key)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            offset, found = self._find(h, level)
+            if not found:
+                self.misses += 1
+                return None
+            self.hits += 1
+            length = SLOT.unpack_from(self._map, offset)[3]
+            SLOT.pack_into(self._map, offset, h, level, self._tick(), length)
+            start = offset + SLOT.size
+            return self._map[start:start + length]
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def put(self, key, value):
+        ''' Store value (bytes); values too long for a slot are not kept '''
+        if self._map is None or len(value) > SLOT_SIZE - SLOT.size:
+            return
+        h, level = _disk_key(key)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            offset, found = self._find(h, level)
+            SLOT.pack_into(self._map, offset, h, level, self._tick(),
+                           len(value))
+            start = offset + SLOT.size
+            self._map[start:start + len(value)] = value
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def _disk_key(key):
+    ''' (hash, level) -> the numbers stored in a slot '''
+    h, level = key
+    return h & 0xffffffffffffffff, zlib.crc32(level.encode())
@@ -12,8 +12,9 @@
 # Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
 
 from gi.repository import Gtk, Gdk, GdkPixbuf, GLib
+import cairo
 import os
-import subprocess
+import time
 
 from gettext import gettext as _
 
@@ -21,21 +22,16 @@ import logging
 _logger = logging.getLogger('GNUChessActivity')
 
 from sprites import Sprites, Sprite
+from atlas import PieceAtlas
+from game import GameController, ENGINES
+from engine import find_binary
+from transcript import Transcript
 from piece import svg_header, svg_footer, svg_king, svg_queen, svg_bishop, \
     svg_knight, svg_rook, svg_pawn
 
-ROBOT_MOVE = 'My move is : '
 TOP = 3
 MID = 2
 BOT = 1
-STATUS = 'status'
-ROBOT = 'robot'
-RESTORE = 'restore'
-REMOVE = 'remove'
-UNDO = 'undo'
-HINT = 'hint'
-GAME = 'game'
-NEW = 'new'
 # Skin indicies
 WP = 0
 BP = 1
@@ -51,22 +47,21 @@ WK = 10
 BK = 11
 FILES = 'abcdefgh'
 RANKS = '12345678'
-BIN = {'i686': 'i686', 'i586': 'i686', 'armv7l': 'armv7l', 'x86_64': 'x86_64'}
 PATHS = {WP: 'white-pawn', WR: 'white-rook', WN: 'white-knight',
          WB: 'white-bishop', WQ: 'white-queen', WK: 'white-king',
          BP: 'black-pawn', BR: 'black-rook', BN: 'black-knight',
          BB: 'black-bishop', BQ: 'black-queen', BK: 'black-king'}
 TYPES = {WP: 'P', WR: 'R', WN: 'N', WB: 'B', WQ: 'Q', WK: 'K',
          BP: 'p', BR: 'r', BN: 'n', BB: 'b', BQ: 'q', BK: 'k'}
+_boxes = {}  # (w, h, color) -> cairo.ImageSurface, see box_surface
 
 
 class Gnuchess():
 
     def __init__(self, canvas, parent=None, path=None,
-                 colors=['#A0FFA0', '#FF8080']):
+                 colors=['#A0FFA0', '#FF8080'], data_path=None):
         self._activity = parent
         self._bundle_path = path
-        self._bin_path = 'bin/i686'
         self._colors = ['#FFFFFF']
         self._colors.append(colors[0])
         self._colors.append(colors[1])
@@ -90,179 +85,127 @@ class Gnuchess():
         self.scale = int((self._height - 55) / 10)
         self.we_are_sharing = False
 
-        self.move_list = []
-        self.game = ''
-
         self._press = None
         self._release = None
         self._dragpos = [0, 0]
         self._total_drag = [0, 0]
         self._last_piece_played = [None, (0, 0)]
 
-        self._thinking = False
         self._flashing = False
         self._defer_flash = [None, 0]
         self._queue_check = False
         self._move = 0
         self._counter = 0
-        self.check = False
-        self.checkmate = False
 
         self.white = []
         self.black = []
+        self._roles = {}  # piece letter -> its sprites, in the order used
         self._board = []
         self._squares = []
-        self._output = ''
-        self._before = []
-        self._after = []
 
         self.skins = {}
+        self._svg_skins = {}  # (piece, colors, bw) -> pixbuf
+        self.bg = []
+        self._check_sprite = None
+        self._checkmate_sprite = None
 
-        # Generate the sprites we'll need...
+        # Startup is timed phase by phase; see _startup_phase.
+        self._startup_start = time.time()
+        self._startup_times = []
+        self._first_frame = False
+
+        # Generate the sprites we'll need to show the board now; the
+        # rest are made when the activity is idle.
         self._sprites = Sprites(self._canvas)
+        start = time.time()
+        # Pieces drawn in earlier sessions
+        if data_path is not None:
+            self._atlas = PieceAtlas(os.path.join(data_path, 'pieces.png'))
+        else:
+            self._atlas = PieceAtlas()
+        self._startup_phase('piece atlas', time.time() - start)
+        start = time.time()
         self._generate_sprites(colors)
-
-        p = subprocess.Popen(['uname', '-m'], # in my virtual machine, -p returns unknown
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT)
-        tmp_p = p.communicate()
-        self._bin_path = 'bin/%s' % (BIN[tmp_p[0].decode().replace('\n', '')])
+        self._startup_phase('board and pieces', time.time() - start)
+
+        start = time.time()
+        self._transcript = None
+        if os.environ.get('GNUCHESS_TRANSCRIPT'):
+            self._transcript = Transcript(os.environ['GNUCHESS_TRANSCRIPT'])
+        # The game itself; we only show it.
+        self._game = GameController(find_binary(self._bundle_path,
+                                                data_path),
+                                    settings=parent, data_path=data_path,
+                                    engines=ENGINES,
+                                    transcript=self._transcript)
+        self._game.connect('status', self._status_cb)
+        self._game.connect('position', self._position_cb)
+        self._game.connect('moved', self._moved_cb)
+        self._game.connect('illegal', self._illegal_cb)
+        self._game.connect('hint', self._hint_cb)
+        self._game.connect('thinking', self._thinking_cb)
+        self._game.connect('robot-moved', self._robot_moved_cb)
+        self._startup_phase('gnuchess', time.time() - start)
         self._all_clear()
-        os.system('chmod -R 755 bin -f')
-
-    def move(self, my_move):
-        ''' Send a command to gnuchess. '''
-        # Permission to play
-        p = subprocess.Popen(['{}/{}/gnuchess'.format(self._bundle_path,
-                                                      self._bin_path)],
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT)
-        if my_move == HINT:
-            level = 'hard\nbook on\n'  # may as well get a good hint
-        elif self._activity.playing_mode == 'easy':
-            level = 'easy\nbook off\ndepth 1\n'
+
+        GLib.idle_add(self._deferred_cb, self._deferred_sprites(colors))
+
+    @property
+    def move_list(self):
+        return self._game.move_list
+
+    @property
+    def game(self):
+        return self._game.game
+
+    def close(self):
+        ''' Shut down the gnuchess session. '''
+        self._game.close()
+        self._atlas.save()
+        if self._transcript is not None:
+            self._transcript.close()
+
+    def move(self, my_move, done=None):
+        ''' Play a move (or send a command) in the game '''
+        self._game.move(my_move, done)
+
+    def _status_cb(self, text):
+        self._activity.status.set_label(text)
+
+    def _thinking_cb(self, busy):
+        if busy:
+            self._activity.set_thinking_cursor()
         else:
-            level = 'hard\nbook on\n'
-
-        if my_move in [REMOVE, UNDO, RESTORE, HINT, GAME, NEW]:
-            hint = False
-            if my_move == REMOVE:
-                self.move_list = self.move_list[:-2]
-            elif my_move == UNDO:
-                self.move_list = self.move_list[:-1]
-            cmd = 'force manual\n'
-            for move in self.move_list:
-                cmd += '%s\n' % (move)
-            if my_move == HINT:
-                cmd += '%sgo\nquit\n' % (level)
-                hint = True
-            elif my_move == GAME:
-                cmd += 'show game\nquit\n'
-            else:
-                cmd += 'show board\nquit\n'
-            output = p.communicate(input=cmd.encode())
-            self._process_output(output[0], my_move=None, hint=hint)
-        elif my_move == ROBOT:  # Ask the computer to play
-            cmd = 'force manual\n'
-            for move in self.move_list:
-                cmd += '%s\n' % (move)
-            cmd += '%sgo\nshow board\nquit\n' % (level)
-            output = p.communicate(input=cmd.encode())
-            self._process_output(output[0], my_move='robot')
-        elif my_move == STATUS:  # reading board state
-            cmd = 'force manual\n'
-            for move in self.move_list:
-                cmd += '%s\n' % (move)
-            cmd += 'show board\nquit\n'
-            output = p.communicate(input=cmd.encode())
-            self._process_output(output[0], my_move=STATUS)
-        elif my_move is not None:  # human's move
-            cmd = 'force manual\n'
-            for move in self.move_list:
-                cmd += '%s\n' % (move)
-            cmd += '%s\n' % (my_move)
-            cmd += 'show board\nquit\n'
-            output = p.communicate(input=cmd.encode())
-            self._process_output(output[0], my_move=my_move)
-
-    def _process_output(self, output, my_move=None, hint=False):
-        ''' process output from gnuchess command '''
-        self.check = False
-        self.checkmate = False
-        self.valid_move = False
-        output = output.decode()
-        if my_move == STATUS:  # Just reading board state
-            self._output = output
-            return
-        elif 'White   Black' in output:  # processing show game
-            target = 'White   Black'
-            output = output[output.find(target):]
-            self.game = output[:output.find('\n\n')]
-            return
-        elif hint:  # What would the robot do?
-            output = output[output.find(ROBOT_MOVE):]
-            hint = output[len(ROBOT_MOVE):output.find('\n')]
-            self._activity.status.set_label(hint)
-            self._parse_move(hint)
-            self._thinking = False
             self._activity.restore_cursor()
-            return
-        elif 'Illegal move' in output:
-            self._activity.status.set_label(_('Illegal move'))
-            if self._last_piece_played[0] is not None:
-                self._last_piece_played[0].move(self._last_piece_played[1])
-                self._last_piece_played[0] = None
-        elif my_move == ROBOT:
-            if 'wins' in output or 'loses' in output:
-                self.checkmate = True
-            output = output[output.find(ROBOT_MOVE):]
-            robot_move = output[len(ROBOT_MOVE):output.find('\n')]
-            self.move_list.append(robot_move)
-            self.valid_move = True
-            if '+' in robot_move:
-                self.check = True
-            if '#' in robot_move or '++' in robot_move:
-                self.checkmate = True
-            if self._activity.playing_white:
-                self._activity.black_entry.set_text(robot_move)
-                self._activity.white_entry.set_text('')
-            else:
-                self._activity.white_entry.set_text(robot_move)
-                self._activity.black_entry.set_text('')
-            self._thinking = False
-            self._activity.restore_cursor()
-        elif my_move is not None:
-            if 'wins' in output or 'loses' in output:
-                self.checkmate = True
-            self.move_list.append(my_move)
-            self.valid_move = True
-            if self._activity.playing_white:
-                self._activity.white_entry.set_text(my_move)
-                self._activity.black_entry.set_text('')
-            else:
-                self._activity.black_entry.set_text(my_move)
-                self._activity.white_entry.set_text('')
 
-        if len(self.move_list) % 2 == 0:
-            target = 'white  '
-        else:
-            target = 'black  '
-        while output.find(target) > 0:
-            output = output[output.find(target):]
-            output = output[output.find('\n'):]
-        if len(output) < 136 or output[0:3] == 'GNU':
-            self._activity.status.set_label('???')
+    def _moved_cb(self, san):
+        if len(self.move_list) % 2 == 1:
+            self._activity.white_entry.set_text(san)
+            self._activity.black_entry.set_text('')
         else:
-            self._load_board(output)
+            self._activity.black_entry.set_text(san)
+            self._activity.white_entry.set_text('')
+
+    def _illegal_cb(self, move):
+        self._activity.status.set_label(_('Illegal move'))
+        if self._last_piece_played[0] is not None:
+            self._last_piece_played[0].move(self._last_piece_played[1])
+            self._last_piece_played[0] = None
 
-        if self.checkmate or self.check:
+    def _hint_cb(self, san):
+        self._activity.status.set_label(san)
+        self._parse_move(san)
+
+    def _position_cb(self, squares):
+        ''' Draw the board as it now is '''
+        self._load_board(squares)
+
+        if self._game.checkmate or self._game.check:
             self._flash_check()
         else:
             if self._activity.time_interval and \
                (self._activity.time_interval >= 0) and \
-               self.valid_move == True:
+               self._game.valid_move == True:
                 self._activity.stopwatch(self._activity.time_interval,
                                          self._activity.alert_time)
 
@@ -271,34 +214,27 @@ class Gnuchess():
             else:
                 self._activity.status.set_label(_("It is Black's move."))
 
+    def time_up(self):
+        self._game.time_up()
+
     def _all_clear(self):
         ''' Things to reinitialize when starting up a new game. '''
-        for i in range(3):
-            self.bg[i].set_layer(-1)
-            self.bg[i].set_label('')
-        self.move_list = []
-        self.game = ''
-        self.check = False
+        self._game.clear()
+        for spr in self.bg:
+            spr.set_layer(-1)
+            spr.set_label('')
         self._hide_check()
-        self.checkmate = False
         self._hide_checkmate()
 
     def new_game(self):
         self._all_clear()
-        self.move(NEW)
-        if self._activity.playing_robot and not self._activity.playing_white:
-            self.move(ROBOT)
+        self._game.new_game()
 
         if self.we_are_sharing and self._activity.collab.props.leader:
             self._activity.send_new_game()
 
     def restore_game(self, move_list):
-        self.move_list = []
-
-        for move in move_list:
-            self.move_list.append(str(move))
-
-        self.move(RESTORE)
+        self._game.restore_game(move_list)
 
         if len(self.move_list) > 0:
             if '#' in self.move_list[-1] or '++' in self.move_list[-1]:
@@ -320,17 +256,17 @@ class Gnuchess():
             self._activity.send_restore()
 
     def copy_game(self):
-        self.move(GAME)
-        return self.game
+        return self._game.copy_game()
 
     def save_game(self):
-        return self.move_list
+        return self._game.save_game()
 
     def show_game_history(self, tag_pairs):
         if not self._activity.showing_game_history:
+            self._generate_extras()
             for i in range(3):
                 self.bg[i].set_layer(TOP)
-            self.move(GAME)
+            self._game.copy_game()
             # Split into two columns
             if ' 14.' in self.game:
                 i = self.game.index(' 14.')
@@ -379,7 +315,7 @@ class Gnuchess():
         elif spr.type == 'checkmate':
             self._hide_checkmate()
             return
-        elif self._thinking or self._flashing:
+        elif self._game.thinking or self._flashing:
             # Robot is thinking or conjuring up a hint
             self._wait_your_turn()
             return
@@ -482,24 +418,18 @@ class Gnuchess():
             self._activity.black_entry.set_text(move)
         self._activity.status.set_label('making a move %s' % (move))
         self.move(move)
-
-        # Get game notation from last move to share and to check for
-        # check, checkmate
-        self.move(GAME)
-        if self.game == '':
+        if not self._game.valid_move:
             _logger.debug('bad move: reseting')
             return True
-        last_move = self.game.split()[-1]
+
+        # The move is recorded in SAN, to share and to show check and
+        # checkmate
         if self.we_are_sharing:
-            self._activity.send_event('m', last_move)
-        if '+' in last_move:
-            self.check = True
-            self._activity.status.set_label(_('Check'))
-        if '#' in last_move or '++' in last_move:
-            self.checkmate = True
+            self._activity.send_event('m', self.move_list[-1])
+        if self._game.checkmate:
             self._activity.status.set_label(_('Checkmate'))
-        if self.checkmate or self.check:
-            self._flash_check()
+        elif self._game.check:
+            self._activity.status.set_label(_('Check'))
 
         # Check to see if it is the robot's turn
         if self._activity.playing_robot and \
@@ -512,42 +442,40 @@ class Gnuchess():
            len(self.move_list) % 2 == 1:
             _logger.debug("not the robot's turn")
             return True
-        if self._activity.playing_robot and not self.checkmate:
-            self._activity.set_thinking_cursor()
+        if self._activity.playing_robot and not self._game.checkmate:
+            self._game.start_thinking()
             self._activity.status.set_label(_('Thinking...'))
-            self._thinking = True
-            GLib.timeout_add(500, self._robot_move)
+            if self._game.reply_ready():
+                # Pondered while the human was thinking: no need to wait
+                GLib.idle_add(self._game.robot_move, self._game.generation)
+            else:
+                GLib.timeout_add(500, self._game.robot_move,
+                                 self._game.generation)
 
         return True
 
-    def _robot_move(self):
-        self._get_before()
-        self.move(ROBOT)
+    def _robot_moved_cb(self, old, new):
         # Flash the squares of any piece that robot has moved
-        self._get_after()
-        if len(self._after) < 64:
-            # Game is over
-            return
         pieces = []  # Array, since if could be a castling move
         before = []
         after = []
         for i in range(64):
-            if self._before[i] != self._after[i]:
+            if old[i] != new[i]:
                 if self._activity.playing_white and \
-                   self._before[i] in 'prnbqk':
-                    pieces.append(self._before[i])
+                   old[i] in 'prnbqk':
+                    pieces.append(old[i])
                     before.append(i)
                 elif not self._activity.playing_white and \
-                     self._before[i] in 'PRNBQK':
-                    pieces.append(self._before[i])
+                     old[i] in 'PRNBQK':
+                    pieces.append(old[i])
                     before.append(i)
                 if self._activity.playing_white and \
-                   self._after[i] in 'prnbqk':
-                    pieces.append(self._after[i])
+                   new[i] in 'prnbqk':
+                    pieces.append(new[i])
                     after.append(i)
                 elif not self._activity.playing_white and \
-                     self._after[i] in 'PRNBQK':
-                    pieces.append(self._after[i])
+                     new[i] in 'PRNBQK':
+                    pieces.append(new[i])
                     after.append(i)
         tiles = []
         for i in range(len(before)):
@@ -555,50 +483,18 @@ class Gnuchess():
             tiles.append(self._index_to_file_and_rank(after[i]))
         self._flash_tile(tiles, flash_color=3)
 
-    def _get_before(self):
-        self.move(STATUS)
-        if self._activity.playing_white:
-            tmp = self._output.split('Black')
-        else:
-            tmp = self._output.split('White')
-        self._before = tmp[-2][-137:].split()
-
-    def _get_after(self):
-        self.move(STATUS)
-        if self._activity.playing_white:
-            tmp = self._output.split('White')
-        else:
-            tmp = self._output.split('Black')
-        self._after = tmp[-2][-137:].split()
-
     def undo(self):
-        # TODO: Lock out while robot is playing
-        if self._activity.playing_robot and len(self.move_list) > 1:
-            if self._activity.playing_white:
-                if len(self.move_list) % 2 == 0:
-                    self.move(REMOVE)
-                else:
-                    self.move(UNDO)
-            else:
-                if len(self.move_list) % 2 == 1:
-                    self.move(REMOVE)
-                else:
-                    self.move(UNDO)
-        elif len(self.move_list) > 0:
-            self.move(UNDO)
+        self._game.undo()
 
     def hint(self):
-        # TODO: Lock out while robot is playing
-        if self._thinking:
+        if self._game.thinking:
             self._activity.status.set_label(_('Please wait for your turn.'))
             return
-        self._activity.set_thinking_cursor()
         self._activity.status.set_label(_('Thinking'))
-        self._thinking = True
-        GLib.timeout_add(500, self.move, HINT)
+        self._game.hint()
 
     def _flash_check(self):
-        if self.check:
+        if self._game.check:
             self._activity.status.set_label(_('Check'))
             self._show_check()
         else:
@@ -607,10 +503,10 @@ class Gnuchess():
         self._queue_check = True
         if len(self.move_list) % 2 == 0:
             self._flash_tile([self._xy_to_file_and_rank(
-                self.white[4].get_xy())])
+                self._roles['K'][0].get_xy())])
         else:
             self._flash_tile([self._xy_to_file_and_rank(
-                self.black[4].get_xy())])
+                self._roles['k'][0].get_xy())])
 
     def _flash_tile(self, tiles, flash_color=2):
         # Queue the flashing check for after the flashing of the move
@@ -646,18 +542,22 @@ class Gnuchess():
                 self._flash_tile(tiles, flash_color)
 
     def _show_check(self):
+        self._generate_extras()
         self._check_sprite.set_layer(100)
         GLib.timeout_add(4000, self._hide_check)
 
     def _hide_check(self):
-        self._check_sprite.hide()
+        if self._check_sprite is not None:
+            self._check_sprite.hide()
 
     def _show_checkmate(self):
+        self._generate_extras()
         self._checkmate_sprite.set_layer(100)
         GLib.timeout_add(8000, self._hide_checkmate)
 
     def _hide_checkmate(self):
-        self._checkmate_sprite.hide()
+        if self._checkmate_sprite is not None:
+            self._checkmate_sprite.hide()
 
     def _reset_board_colors(self, tiles):
         for tile in tiles:
@@ -666,896 +566,13 @@ class Gnuchess():
             self._board[i].set_layer(BOT)
 
     def _parse_move(self, move):
-        tiles = []
-        source_file = None
-        source_rank = None
-        capture_file = None
-        capture_rank = None
-        if 'x' in move:
-            capture = True
-        else:
-            capture = False
-        if len(self.move_list) % 2 == 0:
-            white = True
-            if move[0] in FILES:
-                piece = 'P'
-                source_file = move[0]
-                if move[1] in RANKS:
-                    source_rank = move[1]
-            elif move[0] == 'O':
-                if move == 'O-O':
-                    tiles.append('e1')
-                    tiles.append('g1')
-                else:  # O-O-O
-                    tiles.append('c1')
-                    tiles.append('e1')
-                self._flash_tile(tiles)
-                return
-            else:
-                piece = move[0]
-                if move[1] in FILES:
-                    source_file = move[1]
-                    if move[2] in RANKS:
-                        source_rank = move[2]
-                elif move[1] in RANKS:
-                    source_rank = move[1]
-                if source_rank is None or source_file is None:
-                    if move[2] in FILES:
-                        capture_file = move[2]
-                        if len(move) > 3:
-                            if move[3] in RANKS:
-                                capture_rank = move[3]
-        else:
-            white = False
-            if move[0] in FILES:
-                piece = 'p'
-                source_file = move[0]
-                if move[1] in RANKS:
-                    source_rank = move[1]
-            elif move[0] == 'O':
-                if move == 'O-O':
-                    tiles.append('e8')
-                    tiles.append('g8')
-                else:  # O-O-O
-                    tiles.append('c8')
-                    tiles.append('e8')
-                self._flash_tile(tiles)
-                return
-            else:
-                piece = move[0]
-                if move[1] in FILES:
-                    source_file = move[1]
-                    if move[2] in RANKS:
-                        source_rank = move[2]
-                elif move[1] in RANKS:
-                    source_rank = move[1]
-                if source_rank is None or source_file is None:
-                    if move[2] in FILES:
-                        capture_file = move[2]
-                        if len(move) > 3:
-                            if move[3] in RANKS:
-                                capture_rank = move[3]
-        if capture:
-            move = move[move.find('x') + 1:]
-            if white:
-                if move[0] in 'KQBNR':
-                    # capture_piece = move[0]
-                    if len(move) > 1:
-                        if move[1] in FILES:
-                            capture_file = move[1]
-                            if len(move) > 2:
-                                if move[2] in RANKS:
-                                    capture_rank = move[2]
-                        elif move[1] in RANKS:
-                            capture_rank = move[1]
-                else:
-                    # capture_piece = 'p'
-                    if move[0] in FILES:
-                        capture_file = move[0]
-                        if len(move) > 1:
-                            if move[1] in RANKS:
-                                capture_rank = move[1]
-                    elif move[0] in RANKS:
-                        capture_rank = move[0]
-            else:
-                if move[0] in 'KQBNR':
-                    # capture_piece = move[0]
-                    if len(move) > 1:
-                        if move[1] in FILES:
-                            capture_file = move[1]
-                            if len(move) > 2:
-                                if move[2] in RANKS:
-                                    capture_rank = move[2]
-                        elif move[1] in RANKS:
-                            capture_rank = move[1]
-                else:
-                    # capture_piece = 'P'
-                    if move[0] in FILES:
-                        capture_file = move[0]
-                        if len(move) > 1:
-                            if move[1] in RANKS:
-                                capture_rank = move[1]
-                    elif move[0] in RANKS:
-                        capture_rank = move[0]
-
-        if capture_file is None:
-            capture_file = source_file
-        if capture_rank is None:
-            capture_rank = source_rank
-        if source_file is None:
-            source_file = capture_file
-        if source_rank is None:
-            source_rank = capture_rank
-
-        if piece in 'pP':
-            source_file, source_rank = self._search_for_pawn(
-                piece, source_file, source_rank, capture_file, capture_rank,
-                capture=capture)
-        elif piece in 'rR':
-            source_file, source_rank = self._search_for_rook(
-                piece, source_file, source_rank, capture_file, capture_rank)
-        elif piece in 'nN':
-            source_file, source_rank = self._search_for_knight(
-                piece, source_file, source_rank, capture_file, capture_rank)
-        elif piece in 'bB':
-            source_file, source_rank = self._search_for_bishop(
-                piece, source_file, source_rank, capture_file, capture_rank)
-        elif piece in 'qQ':
-            source_file, source_rank = self._search_for_queen(
-                piece, source_file, source_rank, capture_file, capture_rank)
-        elif piece in 'kK':
-            source_file, source_rank = self._search_for_king(
-                piece, source_file, source_rank, capture_file, capture_rank)
-        tiles.append('%s%s' % (source_file, source_rank))
-        tiles.append('%s%s' % (capture_file, capture_rank))
-        self._flash_tile(tiles)
-
-    def _search_for_pawn(self, piece, source_file, source_rank, capture_file,
-                         capture_rank, capture=False):
-        # Check for capture
-        if capture and len(self.move_list) % 2 == 0:
-            if source_file == capture_file:
-                f = FILES.index(capture_file)
-                if f > 0:
-                    i = self._file_and_rank_to_index(
-                        '%s%s' %
-                        (FILES[f - 1], RANKS[RANKS.index(capture_rank) - 1]))
-                    x, y = self._index_to_xy(i)
-                    for p in range(8):
-                        pos = self.white[8 + p].get_xy()
-                        if x == pos[0] and y == pos[1]:
-                            return FILES[f - 1], \
-                                RANKS[RANKS.index(capture_rank) - 1]
-                if f < 7:
-                    i = self._file_and_rank_to_index(
-                        '%s%s' %
-                        (FILES[f + 1], RANKS[RANKS.index(capture_rank) - 1]))
-                    x, y = self._index_to_xy(i)
-                    for p in range(8):
-                        pos = self.white[8 + p].get_xy()
-                        if x == pos[0] and y == pos[1]:
-                            return FILES[f + 1], \
-                                RANKS[RANKS.index(capture_rank) - 1]
-            else:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (source_file, RANKS[RANKS.index(capture_rank) - 1]))
-                x, y = self._index_to_xy(i)
-                for p in range(8):
-                    pos = self.white[8 + p].get_xy()
-                    if x == pos[0] and y == pos[1]:
-                        return source_file, \
-                            RANKS[RANKS.index(capture_rank) - 1]
-        elif capture:
-            if source_file == capture_file:
-                f = FILES.index(capture_file)
-                if f > 0:
-                    i = self._file_and_rank_to_index(
-                        '%s%s' %
-                        (FILES[f - 1], RANKS[RANKS.index(capture_rank) + 1]))
-                    x, y = self._index_to_xy(i)
-                    for p in range(8):
-                        pos = self.black[8 + p].get_xy()
-                        if x == pos[0] and y == pos[1]:
-                            return FILES[f - 1], \
-                                RANKS[RANKS.index(capture_rank) + 1]
-                if f < 7:
-                    i = self._file_and_rank_to_index(
-                        '%s%s' %
-                        (FILES[f + 1], RANKS[RANKS.index(capture_rank) + 1]))
-                    x, y = self._index_to_xy(i)
-                    for p in range(8):
-                        pos = self.black[8 + p].get_xy()
-                        if x == pos[0] and y == pos[1]:
-                            return FILES[f + 1], \
-                                RANKS[RANKS.index(capture_rank) + 1]
-            else:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (source_file, RANKS[RANKS.index(capture_rank) + 1]))
-                x, y = self._index_to_xy(i)
-                for p in range(8):
-                    pos = self.black[8 + p].get_xy()
-                    if x == pos[0] and y == pos[1]:
-                        return source_file, \
-                            RANKS[RANKS.index(capture_rank) + 1]
-        # Check for first move
-        if piece == 'p' and capture_rank == '5':
-            i = self._file_and_rank_to_index('%s7' % (capture_file))
-            x, y = self._index_to_xy(i)
-            for p in range(8):
-                pos = self.black[8 + p].get_xy()
-                if x == pos[0] and y == pos[1]:
-                    return capture_file, '7'
-        elif piece == 'P' and capture_rank == '4':
-            i = self._file_and_rank_to_index('%s2' % (capture_file))
-            x, y = self._index_to_xy(i)
-            for p in range(8):
-                pos = self.white[8 + p].get_xy()
-                if x == pos[0] and y == pos[1]:
-                    return capture_file, '2'
-        # Check for previous space
-        if piece == 'p':
-            i = self._file_and_rank_to_index(
-                '%s%s' %
-                (capture_file, RANKS[RANKS.index(capture_rank) + 1]))
-            x, y = self._index_to_xy(i)
-            for p in range(8):
-                pos = self.black[8 + p].get_xy()
-                if x == pos[0] and y == pos[1]:
-                    return capture_file, RANKS[RANKS.index(capture_rank) + 1]
-        elif piece == 'P':
-            i = self._file_and_rank_to_index(
-                '%s%s' %
-                (capture_file, RANKS[RANKS.index(capture_rank) - 1]))
-            x, y = self._index_to_xy(i)
-            for p in range(8):
-                pos = self.white[8 + p].get_xy()
-                if x == pos[0] and y == pos[1]:
-                    return capture_file, RANKS[RANKS.index(capture_rank) - 1]
-        return capture_file, capture_rank
-
-    def _search_for_rook(self, piece, source_file, source_rank, capture_file,
-                         capture_rank):
-        # Change rank
-        if len(self.move_list) % 2 == 1:
-            for r in range(7 - RANKS.index(capture_rank)):
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (capture_file, RANKS[RANKS.index(capture_rank) + r + 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if piece in 'rR' and (b == 0 or b == 7):
-                        return capture_file, \
-                            RANKS[RANKS.index(capture_rank) + r + 1]
-                    elif piece in 'qQ' and b == 3:
-                        return capture_file, \
-                            RANKS[RANKS.index(capture_rank) + r + 1]
-                    else:
-                        break
-                elif p is not None:
-                    break
-            for r in range(RANKS.index(capture_rank)):
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (capture_file, RANKS[RANKS.index(capture_rank) - r - 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if piece in 'rR' and (b == 0 or b == 7):
-                        return capture_file, \
-                            RANKS[RANKS.index(capture_rank) - r - 1]
-                    elif piece in 'qQ' and b == 3:
-                        return capture_file, \
-                            RANKS[RANKS.index(capture_rank) - r - 1]
-                    else:
-                        break
-                elif p is not None:
-                    break
-        else:
-            for r in range(7 - RANKS.index(capture_rank)):
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (capture_file, RANKS[RANKS.index(capture_rank) + r + 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if piece == 'R' and (w == 0 or w == 7):
-                        return capture_file, \
-                            RANKS[RANKS.index(capture_rank) + r + 1]
-                    elif piece == 'Q' and w == 3:
-                        return capture_file, \
-                            RANKS[RANKS.index(capture_rank) + r + 1]
-                    else:
-                        break
-                elif p is not None:
-                    break
-            for r in range(RANKS.index(capture_rank)):
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (capture_file, RANKS[RANKS.index(capture_rank) - r - 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if piece == 'R' and (w == 0 or w == 7):
-                        return capture_file, \
-                            RANKS[RANKS.index(capture_rank) - r - 1]
-                    elif piece == 'Q' and w == 3:
-                        return capture_file, \
-                            RANKS[RANKS.index(capture_rank) - r - 1]
-                    else:
-                        break
-                elif p is not None:
-                    break
-        # Change file
-        if len(self.move_list) % 2 == 1:
-            for f in range(7 - FILES.index(capture_file)):
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + f + 1], capture_rank))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if piece in 'rR' and (b == 0 or b == 7):
-                        return FILES[FILES.index(capture_file) + f + 1], \
-                            capture_rank
-                    elif piece in 'qQ' and b == 3:
-                        return FILES[FILES.index(capture_file) + f + 1], \
-                            capture_rank
-                    else:
-                        break
-                elif p is not None:
-                    break
-            for f in range(FILES.index(capture_file)):
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - f - 1], capture_rank))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if piece in 'rR' and (b == 0 or b == 7):
-                        return FILES[FILES.index(capture_file) - f - 1], \
-                            capture_rank
-                    elif piece in 'qQ' and b == 3:
-                        return FILES[FILES.index(capture_file) - f - 1], \
-                            capture_rank
-                    else:
-                        break
-                elif p is not None:
-                    break
-        else:
-            for f in range(7 - FILES.index(capture_file)):
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + f + 1], capture_rank))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if piece == 'R' and (w == 0 or w == 7):
-                        return FILES[FILES.index(capture_file) + f + 1], \
-                            capture_rank
-                    elif piece == 'Q' and w == 3:
-                        return FILES[FILES.index(capture_file) + f + 1], \
-                            capture_rank
-                    else:
-                        break
-                elif p is not None:
-                    break
-            for f in range(FILES.index(capture_file)):
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - f - 1], capture_rank))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if piece == 'R' and (w == 0 or w == 7):
-                        return FILES[FILES.index(capture_file) - f - 1], \
-                            capture_rank
-                    elif piece == 'Q' and w == 3:
-                        return FILES[FILES.index(capture_file) - f - 1], \
-                            capture_rank
-                    else:
-                        break
-                elif p is not None:
-                    break
-        if piece in 'rR':
-            return capture_file, capture_rank
-        else:
-            return None, None
-
-    def _search_for_knight(self, piece, source_file, source_rank, capture_file,
-                           capture_rank):
-        if len(self.move_list) % 2 == 1:  # if piece == 'n':
-            if RANKS.index(capture_rank) < 6 and FILES.index(capture_file) > 0:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - 1],
-                     RANKS[RANKS.index(capture_rank) + 2]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b in [1, 6]:
-                        return FILES[FILES.index(capture_file) - 1], \
-                            RANKS[RANKS.index(capture_rank) + 2]
-            if RANKS.index(capture_rank) < 6 and FILES.index(capture_file) < 7:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + 1],
-                     RANKS[RANKS.index(capture_rank) + 2]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b in [1, 6]:
-                        return FILES[FILES.index(capture_file) + 1], \
-                            RANKS[RANKS.index(capture_rank) + 2]
-            if RANKS.index(capture_rank) > 1 and FILES.index(capture_file) < 7:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + 1],
-                     RANKS[RANKS.index(capture_rank) - 2]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b in [1, 6]:
-                        return FILES[FILES.index(capture_file) + 1], \
-                            RANKS[RANKS.index(capture_rank) - 2]
-            if RANKS.index(capture_rank) > 1 and FILES.index(capture_file) > 0:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - 1],
-                     RANKS[RANKS.index(capture_rank) - 2]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b in [1, 6]:
-                        return FILES[FILES.index(capture_file) - 1], \
-                            RANKS[RANKS.index(capture_rank) - 2]
-            if RANKS.index(capture_rank) < 7 and FILES.index(capture_file) > 1:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - 2],
-                     RANKS[RANKS.index(capture_rank) + 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b in [1, 6]:
-                        return FILES[FILES.index(capture_file) - 2], \
-                            RANKS[RANKS.index(capture_rank) + 1]
-            if RANKS.index(capture_rank) < 7 and FILES.index(capture_file) < 6:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + 2],
-                     RANKS[RANKS.index(capture_rank) + 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b in [1, 6]:
-                        return FILES[FILES.index(capture_file) + 2], \
-                            RANKS[RANKS.index(capture_rank) + 1]
-            if RANKS.index(capture_rank) > 0 and FILES.index(capture_file) < 6:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + 2],
-                     RANKS[RANKS.index(capture_rank) - 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b in [1, 6]:
-                        return FILES[FILES.index(capture_file) + 2], \
-                            RANKS[RANKS.index(capture_rank) - 1]
-            if RANKS.index(capture_rank) > 0 and FILES.index(capture_file) > 1:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - 2],
-                     RANKS[RANKS.index(capture_rank) - 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b in [1, 6]:
-                        return FILES[FILES.index(capture_file) - 2], \
-                            RANKS[RANKS.index(capture_rank) - 1]
-        else:
-            if RANKS.index(capture_rank) < 6 and FILES.index(capture_file) > 0:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - 1],
-                     RANKS[RANKS.index(capture_rank) + 2]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w in [1, 6]:
-                        return FILES[FILES.index(capture_file) - 1], \
-                            RANKS[RANKS.index(capture_rank) + 2]
-            if RANKS.index(capture_rank) < 6 and FILES.index(capture_file) < 7:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + 1],
-                     RANKS[RANKS.index(capture_rank) + 2]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w in [1, 6]:
-                        return FILES[FILES.index(capture_file) + 1], \
-                            RANKS[RANKS.index(capture_rank) + 2]
-            if RANKS.index(capture_rank) > 1 and FILES.index(capture_file) < 7:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + 1],
-                     RANKS[RANKS.index(capture_rank) - 2]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w in [1, 6]:
-                        return FILES[FILES.index(capture_file) + 1], \
-                            RANKS[RANKS.index(capture_rank) - 2]
-            if RANKS.index(capture_rank) > 1 and FILES.index(capture_file) > 0:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - 1],
-                     RANKS[RANKS.index(capture_rank) - 2]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w in [1, 6]:
-                        return FILES[FILES.index(capture_file) - 1], \
-                            RANKS[RANKS.index(capture_rank) - 2]
-            if RANKS.index(capture_rank) < 7 and FILES.index(capture_file) > 1:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - 2],
-                     RANKS[RANKS.index(capture_rank) + 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w in [1, 6]:
-                        return FILES[FILES.index(capture_file) - 2], \
-                            RANKS[RANKS.index(capture_rank) + 1]
-            if RANKS.index(capture_rank) < 7 and FILES.index(capture_file) < 6:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + 2],
-                     RANKS[RANKS.index(capture_rank) + 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w in [1, 6]:
-                        return FILES[FILES.index(capture_file) + 2], \
-                            RANKS[RANKS.index(capture_rank) + 1]
-            if RANKS.index(capture_rank) > 0 and FILES.index(capture_file) < 6:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) + 2],
-                     RANKS[RANKS.index(capture_rank) - 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w in [1, 6]:
-                        return FILES[FILES.index(capture_file) + 2], \
-                            RANKS[RANKS.index(capture_rank) - 1]
-            if RANKS.index(capture_rank) > 0 and FILES.index(capture_file) > 1:
-                i = self._file_and_rank_to_index(
-                    '%s%s' %
-                    (FILES[FILES.index(capture_file) - 2],
-                     RANKS[RANKS.index(capture_rank) - 1]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w in [1, 6]:
-                        return FILES[FILES.index(capture_file) - 2], \
-                            RANKS[RANKS.index(capture_rank) - 1]
-        return capture_file, capture_rank
-
-    def _search_for_bishop(self, piece, source_file, source_rank, capture_file,
-                           capture_rank):
-        # rank++, file++
-        if len(self.move_list) % 2 == 1:  # if piece in 'bq':
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file) + 1
-            while r < 8 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if piece in 'bB' and (b == 2 or b == 5):
-                        return FILES[f], RANKS[r]
-                    elif piece in 'qQ' and b == 3:
-                        return FILES[f], RANKS[r]
-                    else:
-                        break
-                elif p is not None:
-                    break
-                r += 1
-                f += 1
-        if len(self.move_list) % 2 == 0:  # if piece in 'BQ':
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file) + 1
-            while r < 8 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if piece == 'B' and (w == 2 or w == 5):
-                        return FILES[f], RANKS[r]
-                    elif piece == 'Q' and w == 3:
-                        return FILES[f], RANKS[r]
-                    else:
-                        break
-                elif p is not None:
-                    break
-                r += 1
-                f += 1
-        # rank--, file++
-        if len(self.move_list) % 2 == 1:  # if piece in 'bq':
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file) + 1
-            while r > -1 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if piece in 'bB' and (b == 2 or b == 5):
-                        return FILES[f], RANKS[r]
-                    elif piece in 'qQ' and b == 3:
-                        return FILES[f], RANKS[r]
-                    else:
-                        break
-                elif p is not None:
-                    break
-                r -= 1
-                f += 1
-        if len(self.move_list) % 2 == 0:  # if piece in 'BQ':
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file) + 1
-            while r > -1 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if piece == 'B' and (w == 2 or w == 5):
-                        return FILES[f], RANKS[r]
-                    elif piece == 'Q' and w == 3:
-                        return FILES[f], RANKS[r]
-                    else:
-                        break
-                elif p is not None:
-                    break
-                r -= 1
-                f += 1
-        # rank-- file--
-        if len(self.move_list) % 2 == 1:  # if piece in 'bq':
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file) - 1
-            while r > -1 and f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if piece in 'bB' and (b == 2 or b == 5):
-                        return FILES[f], RANKS[r]
-                    elif piece in 'qQ' and b == 3:
-                        return FILES[f], RANKS[r]
-                    else:
-                        break
-                elif p is not None:
-                    break
-                r -= 1
-                f -= 1
-        if len(self.move_list) % 2 == 0:  # if piece in 'BQ':
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file) - 1
-            while r > -1 and f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if piece == 'B' and (w == 2 or w == 5):
-                        return FILES[f], RANKS[r]
-                    elif piece == 'Q' and w == 3:
-                        return FILES[f], RANKS[r]
-                    else:
-                        break
-                elif p is not None:
-                    break
-                r -= 1
-                f -= 1
-        # rank++ file--
-        if len(self.move_list) % 2 == 1:  # if piece in 'bq':
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file) - 1
-            while r < 8 and f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if piece in 'bB' and (b == 2 or b == 5):
-                        return FILES[f], RANKS[r]
-                    elif piece in 'qQ' and b == 3:
-                        return FILES[f], RANKS[r]
-                    else:
-                        break
-                elif p is not None:
-                    break
-                r += 1
-                f -= 1
-        if len(self.move_list) % 2 == 0:  # if piece in 'BQ':
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file) - 1
-            while r < 8 and f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if piece == 'B' and (w == 2 or w == 5):
-                        return FILES[f], RANKS[r]
-                    elif piece == 'Q' and w == 3:
-                        return FILES[f], RANKS[r]
-                    else:
-                        break
-                elif p is not None:
-                    break
-                r += 1
-                f -= 1
-        return capture_file, capture_rank
-
-    def _search_for_queen(self, piece, source_file, source_rank, capture_file,
-                          capture_rank):
-        file_and_rank = self._search_for_rook(
-            piece, source_file, source_rank, capture_file, capture_rank)
-        if file_and_rank[0] is not None:
-            return file_and_rank[0], file_and_rank[1]
-        return self._search_for_bishop(
-            piece, source_file, source_rank, capture_file, capture_rank)
-
-    def _search_for_king(self, piece, source_file, source_rank, capture_file,
-                         capture_rank):
-        if len(self.move_list) % 2 == 1:  # if piece == 'k':
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file) + 1
-            if r < 8 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file)
-            if r < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file) - 1
-            if r < 8 and f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank)
-            f = FILES.index(capture_file) + 1
-            if r < 8 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank)
-            f = FILES.index(capture_file) - 1
-            if f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file) + 1
-            if r > -1 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file)
-            if r > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file) - 1
-            if r > -1 and f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.black:
-                    b = self.black.index(p)
-                    if b == 4:
-                        return FILES[f], RANKS[r]
-        else:
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file) + 1
-            if r < 8 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file)
-            if r < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) + 1
-            f = FILES.index(capture_file) - 1
-            if r < 8 and f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank)
-            f = FILES.index(capture_file) + 1
-            if r < 8 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank)
-            f = FILES.index(capture_file) - 1
-            if f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file) + 1
-            if r > -1 and f < 8:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file)
-            if r > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w == 4:
-                        return FILES[f], RANKS[r]
-            r = RANKS.index(capture_rank) - 1
-            f = FILES.index(capture_file) - 1
-            if r > -1 and f > -1:
-                i = self._file_and_rank_to_index('%s%s' % (FILES[f], RANKS[r]))
-                p = self._find_piece_at_index(i)
-                if p in self.white:
-                    w = self.white.index(p)
-                    if w == 4:
-                        return FILES[f], RANKS[r]
-        return capture_file, capture_rank
+        ''' Flash the squares a move (in SAN) goes from and to '''
+        squares = self._game.move_squares(move)
+        if squares is None:
+            return
+        frm, to = squares
+        self._flash_tile([self._index_to_file_and_rank(frm),
+                          self._index_to_file_and_rank(to)])
 
     def remote_move(self, move):
         ''' Receive a move from a network '''
@@ -1572,21 +589,6 @@ class Gnuchess():
         _logger.debug('enabling sharing')
         self.we_are_sharing = share
 
-    def _find_piece_at_index(self, i):
-        pos = self._index_to_xy(i)
-        return self._find_piece_at_xy(pos)
-
-    def _find_piece_at_xy(self, pos):
-        for w in self.white:
-            x, y = w.get_xy()
-            if x == pos[0] and y == pos[1]:
-                return w
-        for b in self.black:
-            x, y = b.get_xy()
-            if x == pos[0] and y == pos[1]:
-                return b
-        return None
-
     def _index_to_file_and_rank(self, i):
         return '%s%s' % (FILES[i % 8], RANKS[7 - int(i / 8)])
 
@@ -1612,6 +614,10 @@ class Gnuchess():
 
     def __draw_cb(self, canvas, cr):
         self._sprites.redraw_sprites(cr=cr)
+        if not self._first_frame:
+            self._first_frame = True
+            _logger.debug('startup: first frame after %.1f ms' %
+                          (1000 * (time.time() - self._startup_start)))
 
     def do_expose_event(self, event):
         ''' Handle the expose-event by drawing '''
@@ -1627,120 +633,69 @@ class Gnuchess():
         Gtk.main_quit()
 
     def _load_board(self, board):
-        ''' Load the board based on gnuchess board output '''
+        ''' Place the pieces from a list of 64 squares (a8 first) '''
         # _logger.debug(board)
-        white_pawns = 0
-        white_rooks = 0
-        white_knights = 0
-        white_bishops = 0
-        white_queens = 0
-        black_pawns = 0
-        black_rooks = 0
-        black_knights = 0
-        black_bishops = 0
-        black_queens = 0
-        w, h = self.white[0].get_dimensions()
         xo = self._width - 8 * self.scale
         xo = int(xo / 2)
         yo = int(self.scale / 2)
         for i in range(17):  # extra queen
             self.black[i].move((-self.scale, -self.scale))
             self.white[i].move((-self.scale, -self.scale))
-        k = 1
-        for i in range(8):
-            x = xo
-            y = yo + i * self.scale
-            for j in range(8):
-                piece = board[k]
-                k += 2
-                if piece in 'PRNBQK':  # white
-                    if piece == 'P':
-                        self.white[8 + white_pawns].move((x, y))
-                        white_pawns += 1
-                    elif piece == 'R':
-                        if white_rooks == 0:
-                            self.white[0].move((x, y))
-                            white_rooks += 1
-                        else:
-                            self.white[7].move((x, y))
-                            white_rooks += 1
-                    elif piece == 'N':
-                        if white_knights == 0:
-                            self.white[1].move((x, y))
-                            white_knights += 1
-                        else:
-                            self.white[6].move((x, y))
-                            white_knights += 1
-                    elif piece == 'B':
-                        if white_bishops == 0:
-                            self.white[2].move((x, y))
-                            white_bishops += 1
-                        else:
-                            self.white[5].move((x, y))
-                            white_bishops += 1
-                    elif piece == 'Q':
-                        if white_queens == 0:
-                            self.white[3].move((x, y))
-                            white_queens += 1
-                        else:
-                            self.white[16].move((x, y))
-                            self.white[16].set_layer(MID)
-                    elif piece == 'K':
-                        self.white[4].move((x, y))
-                elif piece in 'prnbqk':  # black
-                    if piece == 'p':
-                        self.black[8 + black_pawns].move((x, y))
-                        black_pawns += 1
-                    elif piece == 'r':
-                        if black_rooks == 0:
-                            self.black[0].move((x, y))
-                            black_rooks += 1
-                        else:
-                            self.black[7].move((x, y))
-                            black_rooks += 1
-                    elif piece == 'n':
-                        if black_knights == 0:
-                            self.black[1].move((x, y))
-                            black_knights += 1
-                        else:
-                            self.black[6].move((x, y))
-                            black_knights += 1
-                    elif piece == 'b':
-                        if black_bishops == 0:
-                            self.black[2].move((x, y))
-                            black_bishops += 1
-                        else:
-                            self.black[5].move((x, y))
-                            black_bishops += 1
-                    elif piece == 'q':
-                        if black_queens == 0:
-                            self.black[3].move((x, y))
-                            black_queens += 1
-                        else:
-                            self.black[16].move((x, y))
-                            self.black[16].set_layer(MID)
-                    elif piece == 'k':
-                        self.black[4].move((x, y))
-                x += self.scale
-            x = xo
-            y += self.scale
-            k += 1
+        used = {}
+        for i in range(64):
+            piece = board[i]
+            if piece not in self._roles:
+                continue
+            # Take the next sprite in the role; a third queen shares the
+            # extra queen.
+            n = min(used.get(piece, 0), len(self._roles[piece]) - 1)
+            used[piece] = n + 1
+            spr = self._roles[piece][n]
+            spr.move((xo + (i % 8) * self.scale, yo + (i // 8) * self.scale))
+            if piece in 'Qq' and n > 0:
+                spr.set_layer(MID)
 
     def reskin_from_svg(self, piece, colors, bw='#ffffff'):
+        self.reskin(piece, self._svg_skin(piece, colors, bw))
+
+    def _svg_skin(self, piece, colors, bw):
+        ''' A piece drawn in colors, made once for each set of colors '''
         DICT = {'white_pawn': svg_pawn, 'black_pawn': svg_pawn,
                 'white_rook': svg_rook, 'black_rook': svg_rook,
                 'white_knight': svg_knight, 'black_knight': svg_knight,
                 'white_bishop': svg_bishop, 'black_bishop': svg_bishop,
                 'white_queen': svg_queen, 'black_queen': svg_queen,
                 'white_king': svg_king, 'black_king': svg_king}
-        pixbuf = svg_str_to_pixbuf(
-            svg_header(colors) + DICT[piece](bw) + svg_footer(),
-            w=self.scale, h=self.scale)
-        self.reskin(piece, pixbuf)
+        key = (piece, tuple(colors), bw)
+        if key not in self._svg_skins:
+            atlas_key = (piece, self.scale, ' '.join(list(colors) + [bw]),
+                         _mtime('%s/piece.py' % (self._bundle_path)))
+            pixbuf = self._atlas.get(atlas_key)
+            if pixbuf is None:
+                pixbuf = svg_str_to_pixbuf(
+                    svg_header(colors) + DICT[piece](bw) + svg_footer(),
+                    w=self.scale, h=self.scale)
+                self._atlas.put(atlas_key, pixbuf)
+            self._svg_skins[key] = pixbuf
+        return self._svg_skins[key]
+
+    def _icon_skin(self, file_path):
+        ''' A piece drawn from one of the icons in the bundle '''
+        key = (os.path.basename(file_path), self.scale, '',
+               _mtime(file_path))
+        pixbuf = self._atlas.get(key)
+        if pixbuf is None:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(
+                file_path, self.scale, self.scale)
+            self._atlas.put(key, pixbuf)
+        return pixbuf
 
     def reskin_from_file(self, piece, file_path, return_pixbuf=False):
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(
-            file_path, self.scale, self.scale)
+        if file_path.startswith('%s/icons/' % (self._bundle_path)):
+            pixbuf = self._icon_skin(file_path)
+        else:  # from the Journal
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(
+                file_path, self.scale, self.scale)
         self.reskin(piece, pixbuf)
         if return_pixbuf:
             return pixbuf
@@ -1753,68 +708,58 @@ class Gnuchess():
                 'white_queen': WQ, 'black_queen': BQ,
                 'white_king': WK, 'black_king': BK}
         self.skins[DICT[piece]] = pixbuf
-        if piece == 'white_pawn':
-            for i in range(8):
-                self.white[i + 8].set_image(pixbuf)
-                self.white[i + 8].set_layer(MID)
-        elif piece == 'black_pawn':
-            for i in range(8):
-                self.black[i + 8].set_image(pixbuf)
-                self.black[i + 8].set_layer(MID)
-        elif piece == 'white_rook':
-            self.white[0].set_image(pixbuf)
-            self.white[7].set_image(pixbuf)
-            self.white[0].set_layer(MID)
-            self.white[7].set_layer(MID)
-        elif piece == 'black_rook':
-            self.black[0].set_image(pixbuf)
-            self.black[7].set_image(pixbuf)
-            self.black[0].set_layer(MID)
-            self.black[7].set_layer(MID)
-        elif piece == 'white_knight':
-            self.white[1].set_image(pixbuf)
-            self.white[6].set_image(pixbuf)
-            self.white[1].set_layer(MID)
-            self.white[6].set_layer(MID)
-        elif piece == 'black_knight':
-            self.black[1].set_image(pixbuf)
-            self.black[6].set_image(pixbuf)
-            self.black[1].set_layer(MID)
-            self.black[6].set_layer(MID)
-        elif piece == 'white_bishop':
-            self.white[2].set_image(pixbuf)
-            self.white[5].set_image(pixbuf)
-            self.white[2].set_layer(MID)
-            self.white[5].set_layer(MID)
-        elif piece == 'black_bishop':
-            self.black[2].set_image(pixbuf)
-            self.black[5].set_image(pixbuf)
-            self.black[2].set_layer(MID)
-            self.black[5].set_layer(MID)
-        elif piece == 'white_queen':
-            self.white[3].set_image(pixbuf)
-            self.white[16].set_image(pixbuf)
-            self.white[3].set_layer(MID)
-            self.white[16].set_layer(MID)
-        elif piece == 'black_queen':
-            self.black[3].set_image(pixbuf)
-            self.black[16].set_image(pixbuf)
-            self.black[3].set_layer(MID)
-            self.black[16].set_layer(MID)
-        elif piece == 'white_king':
-            self.white[4].set_image(pixbuf)
-            self.white[4].set_layer(MID)
-        elif piece == 'black_king':
-            self.black[4].set_image(pixbuf)
-            self.black[4].set_layer(MID)
-
-    def _generate_sprites(self, colors):
-
+        for spr in self._roles[TYPES[DICT[piece]]]:
+            spr.set_image(pixbuf)
+            spr.set_layer(MID)
+
+    def _startup_phase(self, phase, seconds):
+        ''' Note how long a phase of startup took '''
+        self._startup_times.append((phase, seconds))
+        _logger.debug('startup: %s took %.1f ms' % (phase, 1000 * seconds))
+
+    def _deferred_cb(self, steps):
+        ''' Run the next deferred startup step; idle until done '''
+        try:
+            next(steps)
+            return True
+        except StopIteration:
+            self._atlas.save()
+            _logger.debug('startup: %s' % (', '.join(
+                ['%s %.1f ms' % (phase, 1000 * seconds)
+                 for phase, seconds in self._startup_times])))
+            return False
+
+    def _deferred_sprites(self, colors):
+        ''' What is not needed for the first frame, a step at a time:
+        the game history backgrounds, the check and checkmate overlays
+        and the Sugar skin of the pieces. '''
+        start = time.time()
+        self._generate_extras()
+        self._startup_phase('history and overlays', time.time() - start)
+        yield
+        # One piece at a time, so as not to hold up the first moves
+        seconds = 0
+        for piece in list(PATHS.values()):
+            start = time.time()
+            name = piece.replace('-', '_')
+            if name.startswith('white'):
+                self._svg_skin(name, colors, '#ffffff')
+            else:
+                self._svg_skin(name, colors, '#000000')
+            seconds += time.time() - start
+            yield
+        self._startup_phase('Sugar skin', seconds)
+
+    def _generate_extras(self):
+        ''' The game history backgrounds and the check and checkmate
+        overlays, unless they have been made already '''
+        if self._check_sprite is not None:
+            return
+        colors = self._colors[1:3]
         if 'xo' in self._activity.hardware:
             fontsize = 24
         else:
             fontsize = 18
-        self.bg = []
         for i in range(3):
             self.bg.append(
                 Sprite(self._sprites, 0, 0, self._box(
@@ -1828,21 +773,6 @@ class Gnuchess():
         self.bg[1].move_relative((int(self._width / 3), 0))
         self.bg[2].move_relative((int(2 * self._width / 3), 0))
 
-        xo = self._width - 8 * self.scale
-        xo = int(xo / 2)
-        yo = int(self.scale / 2)
-
-        self.rank = Sprite(self._sprites, xo - self.scale, yo,
-                           GdkPixbuf.Pixbuf.new_from_file_at_size(
-                               '%s/images/rank.svg' % (self._bundle_path),
-                               self.scale, 8 * self.scale))
-        self.rank.set_layer(0)
-        self.file = Sprite(self._sprites, xo, yo + int(self.scale * 8),
-                           GdkPixbuf.Pixbuf.new_from_file_at_size(
-                               '%s/images/file.svg' % (self._bundle_path),
-                               8 * self.scale, self.scale))
-        self.file.set_layer(0)
-
         x = int((Gdk.Screen.width() - 6 * self.scale) / 2.)
         y = int((Gdk.Screen.height() - 4 * self.scale) / 2.)
         self._check_sprite = Sprite(
@@ -1863,6 +793,23 @@ class Gnuchess():
         self._checkmate_sprite.type = 'checkmate'
         self._checkmate_sprite.hide()
 
+    def _generate_sprites(self, colors):
+        ''' The board and the pieces: all that the first frame shows '''
+        xo = self._width - 8 * self.scale
+        xo = int(xo / 2)
+        yo = int(self.scale / 2)
+
+        self.rank = Sprite(self._sprites, xo - self.scale, yo,
+                           GdkPixbuf.Pixbuf.new_from_file_at_size(
+                               '%s/images/rank.svg' % (self._bundle_path),
+                               self.scale, 8 * self.scale))
+        self.rank.set_layer(0)
+        self.file = Sprite(self._sprites, xo, yo + int(self.scale * 8),
+                           GdkPixbuf.Pixbuf.new_from_file_at_size(
+                               '%s/images/file.svg' % (self._bundle_path),
+                               8 * self.scale, self.scale))
+        self.file.set_layer(0)
+
         w = h = self.scale
         self._squares.append(self._box(w, h, color='black'))
         self._squares.append(self._box(w, h, color='white'))
@@ -1884,8 +831,8 @@ class Gnuchess():
             y += self.scale
 
         for piece in list(PATHS.keys()):
-            self.skins[piece] = GdkPixbuf.Pixbuf.new_from_file_at_size(
-                '%s/icons/%s.svg' % (self._bundle_path, PATHS[piece]), w, h)
+            self.skins[piece] = self._icon_skin(
+                '%s/icons/%s.svg' % (self._bundle_path, PATHS[piece]))
 
         for piece in [WR, WN, WB, WQ, WK, WB, WN, WR]:
             self.white.append(Sprite(self._sprites, 0, 0, self.skins[piece]))
@@ -1917,41 +864,37 @@ class Gnuchess():
         self.black[-1].type = TYPES[BQ]
         self.black[-1].hide()
 
+        self._roles = {}
+        for spr in self.white + self.black:
+            self._roles.setdefault(spr.type, []).append(spr)
+
     def _box(self, w, h, color='black'):
         ''' Generate a box '''
-        self._svg_width = w
-        self._svg_height = h
-        return svg_str_to_pixbuf(
-            self._header() +
-            self._rect(self._svg_width, self._svg_height, 0, 0,
-                       color=color) +
-            self._footer())
-
-    def _header(self):
-        return '<svg\n' + 'xmlns:svg="http://www.w3.org/2000/svg"\n' + \
-            'xmlns="http://www.w3.org/2000/svg"\n' + \
-            'xmlns:xlink="http://www.w3.org/1999/xlink"\n' + \
-            'version="1.1"\n' + 'width="' + str(self._svg_width) + '"\n' + \
-            'height="' + str(self._svg_height) + '">\n'
-
-    def _rect(self, w, h, x, y, color='black'):
-        svg_string = '       <rect\n'
-        svg_string += '          width="%f"\n' % (w)
-        svg_string += '          height="%f"\n' % (h)
-        svg_string += '          rx="%f"\n' % (0)
-        svg_string += '          ry="%f"\n' % (0)
-        svg_string += '          x="%f"\n' % (x)
-        svg_string += '          y="%f"\n' % (y)
-        if color == 'black':
-            svg_string += 'style="fill:#000000;stroke:#000000;"/>\n'
-        elif color == 'white':
-            svg_string += 'style="fill:#ffffff;stroke:#ffffff;"/>\n'
-        else:
-            svg_string += 'style="fill:%s;stroke:%s;"/>\n' % (color, color)
-        return svg_string
-
-    def _footer(self):
-        return '</svg>\n'
+        return box_surface(w, h, color)
+
+
+def _mtime(path):
+    ''' When a file was last changed, or 0 if it cannot be found '''
+    try:
+        return int(os.stat(path).st_mtime)
+    except OSError:
+        return 0
+
+
+def box_surface(w, h, color='black'):
+    ''' A surface filled with color ('none' for a clear one). Sprites
+    only draw from their surfaces, so boxes of the same size and color
+    share one. '''
+    key = (w, h, color)
+    if key not in _boxes:
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        rgba = Gdk.RGBA()
+        if color != 'none' and rgba.parse(color):
+            context = cairo.Context(surface)
+            context.set_source_rgb(rgba.red, rgba.green, rgba.blue)
+            context.paint()
+        _boxes[key] = surface
+    return _boxes[key]
 
 
 def svg_str_to_pixbuf(svg_string, w=None, h=None):
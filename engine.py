@@ -0,0 +1,754 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+import atexit
+import heapq
+import math
+import os
+import platform
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from functools import partial
+
+try:
+    from gi.repository import GLib
+except ImportError:
+    GLib = None  # No main loop, so requests are answered synchronously
+
+import logging
+_logger = logging.getLogger('GNUChessActivity')
+
+ROBOT_MOVE = 'My move is : '
+ILLEGAL_MOVE = 'Illegal move'
+GAME_HEADER = 'White   Black'
+# The events OutputParser finds in what gnuchess prints
+MOVE = 'move'  # the move gnuchess played, in SAN
+ILLEGAL = 'illegal'  # a move (or command) gnuchess would not take
+BOARD = 'board'  # the squares from a8 to h1, as 64 piece letters
+GAME = 'game'  # the game record, from its header to its last move
+RESULT = 'result'  # (score, reason), e.g. ('1-0', 'White mates')
+# (depth, score, nodes, moves) after 'post'; the score is in centipawns
+# for the side to move
+VARIATION = 'variation'
+PROMPT = re.compile(r'^((White|Black) \(\d+\) : )+')
+BOARD_ROW = re.compile(r'^([.PRNBQKprnbqk] ){8}$')
+RESULT_LINE = re.compile(r'^(1-0|0-1|1/2-1/2) {(.*)}')
+VARIATION_LINE = re.compile(r'^\s*(\d+)[.&]\s+[\d.]+\s+(-?\d+)\s+(\d+)\t(.*)$')
+# Search priorities for EnginePool; lower numbers are served first
+PRIORITY_ROBOT = 0
+PRIORITY_HINT = 1
+PRIORITY_ANALYSIS = 2
+# gnuchess answers 'ping N' with 'pong N' once every command queued
+# ahead of it has been processed, so we use it to delimit replies.
+PING = 'ping %d\n'
+PONG = 'pong %d\n'
+# gnuchess thinks for about this many times the time per move its 'level'
+# allows, so we ask for a little less.
+LEVEL_OVERSHOOT = 1.5
+DEFAULT_THINK_TIME = 5  # seconds, as gnuchess does before any 'level'
+# The gnuchess builds in bin/ for each machine, the best first
+BIN = {'i686': ['i686'], 'i586': ['i686'], 'armv7l': ['armv7l'],
+       'x86_64': ['x86_64', 'i686']}
+BUNDLE_PATH = os.path.dirname(os.path.abspath(__file__))
+VERIFIED = 'gnuchess.verified'  # names the binary that last passed
+_binaries = {}  # bundle path -> the gnuchess found there
+
+
+def time_control(seconds, ply=0):
+    ''' A 'level' command to make gnuchess move in about (and, as a rule,
+    within) the given number of seconds when searching the position
+    after ply half moves. gnuchess shares the time out among the moves
+    left in the control, counting those already played in the game, so
+    the control is made to end the same number of moves ahead whatever
+    the move; gnuchess paces itself poorly with only a move or two left,
+    so that is at least six. '''
+    per_move = seconds / LEVEL_OVERSHOOT
+    minutes = max(1, int(math.ceil(per_move * 6 / 60.0)))
+    moves = max(6, int(round(minutes * 60 / per_move)))
+    return 'level %d %d 0\n' % (ply // 2 + moves, minutes)
+
+
+def find_binary(bundle_path=BUNDLE_PATH, data_path=None):
+    ''' The gnuchess to run on this machine, found once per bundle. The
+    first time a binary is used it is tried out, and if data_path is
+    given, it is noted there so that it is not tried again until it
+    changes. '''
+    if bundle_path in _binaries:
+        return _binaries[bundle_path]
+    candidates = [os.path.join(bundle_path, 'bin', name, 'gnuchess')
+                  for name in BIN.get(platform.machine(), ['i686'])]
+    verified = None
+    if data_path is not None:
+        try:
+            with open(os.path.join(data_path, VERIFIED)) as fd:
+                verified = fd.read()
+        except (IOError, OSError):
+            pass
+    binary = None
+    for path in candidates:
+        _make_executable(path)
+        stamp = _stamp(path)
+        if stamp is None:
+            continue
+        if stamp == verified or _self_test(path):
+            binary = path
+            if data_path is not None and stamp != verified:
+                try:
+                    with open(os.path.join(data_path, VERIFIED), 'w') as fd:
+                        fd.write(stamp)
+                except (IOError, OSError) as e:
+                    _logger.debug('cannot note verified gnuchess: %s' % (e))
+            break
+    if binary is None:
+        _logger.error('no gnuchess works here; tried %s' % (candidates))
+        binary = candidates[0]
+    _binaries[bundle_path] = binary
+    return binary
+
+
+def _make_executable(path):
+    ''' Bundles unpacked from a zip file may lose the execute bit. '''
+    try:
+        mode = os.stat(path).st_mode
+        if mode & 0o111 != 0o111:
+            os.chmod(path, mode | 0o755)
+    except OSError as e:
+        _logger.debug('cannot make %s executable: %s' % (path, e))
+
+
+def _stamp(path):
+    ''' What identifies a binary as the one that was tried out '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return '%s %d %d\n' % (path, st.st_size, int(st.st_mtime))
+
+
+def _self_test(path):
+    ''' Does the binary run here and answer a ping? '''
+    cwd = tempfile.mkdtemp(prefix='gnuchess-')
+    try:
+        try:
+            process = subprocess.Popen([path], stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, cwd=cwd)
+        except OSError as e:
+            _logger.debug('cannot run %s: %s' % (path, e))
+            return False
+        try:
+            output = process.communicate((PING % 1 + 'quit\n').encode(),
+                                         timeout=5)[0]
+        except subprocess.TimeoutExpired:
+            _logger.debug('%s does not answer' % (path))
+            process.kill()
+            process.wait()
+            return False
+        return (PONG % 1).encode() in output
+    finally:
+        shutil.rmtree(cwd, ignore_errors=True)
+
+
+class CancelToken():
+    ''' Handed in with a search so that whoever asked for it can call it
+    off, or tell gnuchess to move at once. With a timeout, gnuchess is
+    told to move at once when the time is up. '''
+
+    def __init__(self, timeout=None):
+        self.cancelled = False
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = time.time() + timeout
+        self._interrupt = None  # set by whoever holds the search
+        self._timer = None
+
+    def remaining(self):
+        ''' Seconds left before the deadline, or None '''
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.time())
+
+    def cancel(self):
+        ''' Nobody wants the result: stop the search and answer with an
+        empty reply. '''
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self._interrupt is not None:
+            self._interrupt()
+
+    def move_now(self):
+        ''' Stop the search and take the best move found so far (a
+        search still queued is started as soon as a session is free). '''
+        self.deadline = time.time()
+        if self._interrupt is not None:
+            self._interrupt()
+
+
+class OutputParser():
+    ''' Turns gnuchess output into events as it arrives. Output is fed
+    in in pieces of any size and looked at a line at a time, so nothing
+    is scanned twice. Events are (kind, value) pairs: (MOVE, san),
+    (ILLEGAL, move), (BOARD, squares), (GAME, record),
+    (RESULT, (score, reason)) and (VARIATION, (depth, score, nodes,
+    moves)). '''
+
+    def __init__(self):
+        self.events = []
+        self._partial = b''
+        self._rows = []
+        self._game = None
+
+    def feed(self, data):
+        ''' Take some more output; return the events completed by it. '''
+        n = len(self.events)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line.decode('utf-8', 'replace').rstrip('\r'))
+        return self.events[n:]
+
+    def close(self):
+        ''' The output is over: return the events in what is left. '''
+        n = len(self.events)
+        if len(self._partial) > 0:
+            self._line(self._partial.decode('utf-8', 'replace'))
+            self._partial = b''
+        self._end_game()
+        return self.events[n:]
+
+    def _line(self, line):
+        # Out of xboard mode, gnuchess prompts for input with no newline,
+        # so replies follow on the same line.
+        line = PROMPT.sub('', line)
+        # Search progress is overwritten in place with carriage returns;
+        # only what is left at the end of the line counts.
+        line = line[line.rfind('\r') + 1:]
+        if self._game is not None:
+            if line.strip() != '':
+                self._game.append(line.rstrip())
+                return
+            self._end_game()
+        if BOARD_ROW.match(line):
+            self._rows.append(line.replace(' ', ''))
+            if len(self._rows) == 8:
+                self.events.append((BOARD, ''.join(self._rows)))
+                self._rows = []
+            return
+        self._rows = []
+        i = line.find(GAME_HEADER)
+        if i > -1:
+            self._game = [line[i:].rstrip()]
+        elif line.startswith(ROBOT_MOVE):
+            self.events.append((MOVE, line[len(ROBOT_MOVE):].strip()))
+        elif line.startswith(ILLEGAL_MOVE):
+            self.events.append((ILLEGAL, line.split(':', 1)[-1].strip()))
+        else:
+            match = RESULT_LINE.match(line)
+            if match is not None:
+                self.events.append((RESULT, match.groups()))
+                return
+            match = VARIATION_LINE.match(line)
+            if match is not None:
+                depth, score, nodes, moves = match.groups()
+                self.events.append((VARIATION, (int(depth), int(score),
+                                                int(nodes), moves.split())))
+
+    def _end_game(self):
+        if self._game is not None:
+            self.events.append((GAME, '\n'.join(self._game)))
+            self._game = None
+
+
+def parse_output(output):
+    ''' All the events in a complete piece of gnuchess output '''
+    parser = OutputParser()
+    parser.feed(output)
+    parser.close()
+    return parser.events
+
+
+class EngineSession():
+    ''' A gnuchess process kept alive for the length of a game. binary
+    may also be a command line (a list), e.g. to run the stub engine in
+    transcript.py; with a transcript, every exchange is recorded.
+    gnuchess writes game.log where it runs, so it is run in a scratch
+    directory of its own, removed when the session is closed. '''
+
+    def __init__(self, binary, transcript=None):
+        self._binary = binary
+        self._transcript = transcript
+        self._cwd = None
+        self._process = None
+        self._watch = None
+        self._serial = 0
+        self._buffer = b''  # output not yet given to a request's parser
+        # [serial, callback, args, events, commands, time sent, parser,
+        # output kept for the transcript] in flight
+        self._requests = []
+        self._target = None
+        # The history gnuchess holds once the requests in flight are
+        # answered. A search in progress holds a placeholder object in
+        # place of the move it has yet to choose.
+        self.moves = []
+        # Times the whole game was played into gnuchess again, after it
+        # went away or its history had nothing in common with ours
+        self.full_replays = 0
+        self._restarted = False
+        atexit.register(self.close)
+
+    def start(self):
+        ''' Launch gnuchess and put it into manual mode. '''
+        if isinstance(self._binary, list):
+            cmd = self._binary
+        else:
+            cmd = [self._binary]
+        if self._cwd is None:
+            self._cwd = tempfile.mkdtemp(prefix='gnuchess-')
+        self._process = subprocess.Popen(cmd,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT,
+                                         bufsize=0, cwd=self._cwd)
+        self._buffer = b''
+        self.moves = []
+        target = self._target
+        self._target = None
+        self.command('force manual')
+        self._target = target
+
+    def is_alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def is_idle(self):
+        ''' Is nothing in flight? '''
+        return len(self._requests) == 0
+
+    def close(self):
+        ''' Ask gnuchess to quit; kill it if it will not. '''
+        if self._process is None:
+            return
+        process = self._process
+        self._process = None
+        if self._watch is not None:
+            GLib.source_remove(self._watch)
+            self._watch = None
+        try:
+            process.stdin.write(b'quit\n')
+            process.stdin.close()
+            process.wait(timeout=1)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        shutil.rmtree(self._cwd, ignore_errors=True)
+        self._cwd = None
+        self._abandon_requests()
+
+    def sync(self, move_list):
+        ''' Bring the engine to the position after move_list. Only the
+        difference from the position the engine already holds is sent,
+        and it is sent along with the next command. '''
+        self._target = list(move_list)
+
+    def _sync_commands(self):
+        ''' The commands that take the engine from its history to the
+        one requested by the last sync. '''
+        if self._target is None:
+            return []
+        move_list = self._target
+        self._target = None
+        n = 0
+        for a, b in zip(self.moves, move_list):
+            if a != b:
+                break
+            n += 1
+        # Taking back a search still in flight (a placeholder) is not a
+        # replay; only real moves count.
+        if n == 0 and len(move_list) > 0 and \
+           (self._restarted or (len(self.moves) > 0 and
+                                isinstance(self.moves[0], str))):
+            _logger.debug('replaying game')
+            self.full_replays += 1
+        self._restarted = False
+        # Take back to the last common position ('new' would leave stale
+        # entries in the game record) and play forward from there.
+        back = len(self.moves) - n
+        cmd = ['remove'] * (back // 2) + ['undo'] * (back % 2)
+        cmd += move_list[n:]
+        self.moves = move_list
+        return cmd
+
+    @property
+    def synced_ply(self):
+        ''' The number of plies the engine holds (or will hold once
+        pending commands are sent). '''
+        if self._target is not None:
+            return len(self._target)
+        return len(self.moves)
+
+    def _send(self, cmd, callback=None, args=()):
+        ''' Write commands, preceded by any sync commands, and queue a
+        request for the reply. '''
+        if not self.is_alive():
+            moves = [move for move in self.moves if isinstance(move, str)]
+            if self._process is not None:
+                _logger.debug('gnuchess exited; restarting')
+                self._process = None
+                self._abandon_requests()
+                self._restarted = True
+            self.start()
+            if self._target is None:
+                self._target = moves
+        sync = self._sync_commands()
+        if len(sync) > 0:
+            cmd = '%s\n%s' % ('\n'.join(sync), cmd)
+        self._serial += 1
+        request = [self._serial, callback, args, None, cmd, time.time(),
+                   OutputParser(), []]
+        self._requests.append(request)
+        self._process.stdin.write(
+            ('%s\n' % cmd.rstrip('\n') + PING % self._serial).encode())
+        self._process.stdin.flush()
+        return request
+
+    def _feed(self, request, data):
+        request[6].feed(data)
+        if self._transcript is not None:
+            request[7].append(data)
+
+    def _read(self):
+        ''' Read whatever gnuchess has written, hand it to the parser of
+        the request it answers and answer any requests whose replies are
+        complete. '''
+        data = os.read(self._process.stdout.fileno(), 4096)
+        if not data:
+            raise EOFError('gnuchess closed its output')
+        self._buffer += data
+        while len(self._requests) > 0:
+            request = self._requests[0]
+            pong = (PONG % request[0]).encode()
+            i = self._buffer.find(pong)
+            if i < 0:
+                # Parse what has come so far, all but what could be the
+                # start of a pong split between two reads.
+                n = len(self._buffer) - len(pong) + 1
+                if n > 0:
+                    self._feed(request, self._buffer[:n])
+                    self._buffer = self._buffer[n:]
+                break
+            self._requests.pop(0)
+            self._feed(request, self._buffer[:i])
+            self._buffer = self._buffer[i + len(pong):]
+            request[6].close()
+            request[3] = request[6].events
+            if self._transcript is not None:
+                self._transcript.record(request[4], b''.join(request[7]),
+                                        time.time() - request[5])
+            if request[1] is not None:
+                request[1](request[3], *request[2])
+
+    def _abandon_requests(self):
+        ''' gnuchess went away, so answer everything still in flight with
+        an empty reply. '''
+        requests = self._requests
+        self._requests = []
+        for request in requests:
+            request[3] = []
+            if request[1] is not None:
+                request[1]([], *request[2])
+
+    def _io_cb(self, source, condition):
+        ''' Called from the main loop when gnuchess has output. '''
+        try:
+            self._read()
+        except (EOFError, OSError):
+            _logger.debug('lost gnuchess')
+            self._watch = None
+            self._abandon_requests()
+            return False
+        if len(self._requests) == 0:
+            self._watch = None
+            return False
+        return True
+
+    def command(self, cmd):
+        ''' Send one or more newline-separated commands and wait for
+        everything gnuchess prints in reply; return the events read from
+        it. '''
+        request = self._send(cmd)
+        while request in self._requests:
+            self._read()
+        return request[3]
+
+    def request(self, cmd, callback, *args):
+        ''' Send commands and return at once; callback(events, *args) is
+        run from the main loop when gnuchess has replied. '''
+        if GLib is None:
+            callback(self.command(cmd), *args)
+            return None
+        request = self._send(cmd, callback, args)
+        if self._watch is None:
+            self._watch = GLib.io_add_watch(
+                self._process.stdout, GLib.PRIORITY_DEFAULT,
+                GLib.IOCondition.IN | GLib.IOCondition.HUP, self._io_cb)
+        return request
+
+    def game(self):
+        ''' Show the game record. After a take back, gnuchess still
+        prints the old Black reply to the last White move, so we trim the
+        record to the plies actually played. '''
+        for kind, record in self.command('show game'):
+            if kind == GAME:
+                break
+        else:
+            return ''
+        if len(self.moves) % 2 == 1 and '\n' in record:
+            k = record.rfind('\n') + 1
+            line = record[k:]
+            white = line.split()[1]
+            line = line[:line.index(white, line.index('.')) + len(white)]
+            record = record[:k] + line
+        return record
+
+    def play(self, move, suffix=''):
+        ''' Make a move in the current position. '''
+        events = self.command('%s\n%s' % (move, suffix))
+        # Sync commands are sent ahead of the move, so only look at the
+        # reply to the move itself.
+        if (ILLEGAL, move) not in events:
+            self.moves.append(move)
+        return events
+
+    def think(self, level, suffix='', keep=True, callback=None, *args,
+              token=None):
+        ''' Let gnuchess search the current position and play its
+        choice; with keep=False the move is taken back by the next sync.
+        With a callback, return at once and call callback(events, *args)
+        when the search is done. A CancelToken can stop the search. '''
+        cmd = '%sgo\nforce manual\n%s' % (level, suffix)
+        if callback is None or GLib is None:
+            timer = None
+            if token is not None and token.deadline is not None:
+                timer = threading.Timer(token.remaining(), self.interrupt)
+                timer.start()
+            events = self.command(cmd)
+            if timer is not None:
+                timer.cancel()
+            move = robot_move(events)
+            if move is not None:
+                self.moves.append(move if keep else object())
+            if token is not None and token.cancelled:
+                events = []
+            if callback is not None:
+                callback(events, *args)
+            return events
+        placeholder = object()
+        request = self.request(cmd, self._thought_cb, placeholder, keep,
+                               token, callback, args)
+        self.moves.append(placeholder)
+        if token is not None:
+            if token.cancelled:
+                self.interrupt()
+            token._interrupt = partial(self.interrupt, request)
+            if token.deadline is not None:
+                token._timer = GLib.timeout_add(
+                    int(1000 * token.remaining()), self._deadline_cb,
+                    token, request)
+
+    def interrupt(self, request=None):
+        ''' Make gnuchess stop searching and play the best move it has
+        found (which it does on SIGINT). '''
+        if request is not None and request not in self._requests:
+            return  # Already answered
+        if self.is_alive():
+            self._process.send_signal(signal.SIGINT)
+
+    def _deadline_cb(self, token, request):
+        token._timer = None
+        self.interrupt(request)
+        return False
+
+    def _thought_cb(self, events, placeholder, keep, token, callback, args):
+        ''' Put the move gnuchess chose in place of its placeholder. '''
+        if token is not None:
+            token._interrupt = None
+            if token._timer is not None:
+                GLib.source_remove(token._timer)
+                token._timer = None
+        move = robot_move(events)
+        if placeholder in self.moves:
+            i = self.moves.index(placeholder)
+            if move is not None:
+                if keep:
+                    self.moves[i] = move
+            elif i == len(self.moves) - 1:
+                self.moves.pop()
+            else:
+                self._lost_track()
+        elif move is None and len(events) > 0:
+            # A take back went out for a move that was never made.
+            self._lost_track()
+        if token is not None and token.cancelled:
+            events = []  # Nobody wants it now.
+        callback(events, *args)
+
+    def _lost_track(self):
+        ''' We no longer know the engine's history, so start over. '''
+        _logger.debug('gnuchess history unknown; restarting')
+        self._process.kill()
+
+
+def robot_move(events):
+    ''' Return the move gnuchess played in a reply's events, if any. '''
+    for kind, value in events:
+        if kind == MOVE:
+            return value
+    return None
+
+
+def search_result(events):
+    ''' The events of a search worth keeping: the move played and any
+    result of the game. '''
+    return [(kind, value) for kind, value in events
+            if kind in [MOVE, RESULT]]
+
+
+def result_output(events):
+    ''' Kept events as gnuchess printed them, to be stored as bytes and
+    read again with parse_output '''
+    lines = []
+    for kind, value in events:
+        if kind == MOVE:
+            lines.append(ROBOT_MOVE + value)
+        elif kind == RESULT:
+            lines.append('%s {%s}' % value)
+    return ''.join([line + '\n' for line in lines]).encode()
+
+
+class EnginePool():
+    ''' A few warm gnuchess sessions sharing a queue of searches, so a
+    hint need not wait behind the robot's search '''
+
+    def __init__(self, binary, size=2, transcript=None):
+        self._sessions = []
+        for i in range(max(1, size)):
+            self._sessions.append(EngineSession(binary, transcript))
+            self._sessions[-1].start()
+        self._queue = []  # heap of [priority, serial, search]
+        self._running = {}  # session -> the queue entry it is searching
+        self._serial = 0
+
+    @property
+    def full_replays(self):
+        return sum([session.full_replays for session in self._sessions])
+
+    def close(self):
+        self._queue = []
+        for session in self._sessions:
+            session.close()
+
+    def _session_for(self, move_list, idle=True):
+        ''' Pick the session that needs the fewest commands to reach
+        move_list, preferring one with nothing in flight. '''
+        best = None
+        best_cost = None
+        for session in self._sessions:
+            if idle and not session.is_idle():
+                continue
+            n = 0
+            for a, b in zip(session.moves, move_list):
+                if a != b:
+                    break
+                n += 1
+            cost = len(session.moves) + len(move_list) - 2 * n
+            if not session.is_idle():
+                cost += 1000 * len(session._requests)
+            if best is None or cost < best_cost:
+                best = session
+                best_cost = cost
+        return best
+
+    def _session(self, move_list):
+        ''' A session brought to move_list, for a quick command '''
+        session = self._session_for(move_list)
+        if session is None:
+            # Everyone is searching; wait behind the shortest queue.
+            session = self._session_for(move_list, idle=False)
+        session.sync(move_list)
+        return session
+
+    def command(self, move_list, cmd):
+        return self._session(move_list).command(cmd)
+
+    def game(self, move_list):
+        return self._session(move_list).game()
+
+    def play(self, move_list, move, suffix=''):
+        return self._session(move_list).play(move, suffix)
+
+    def think(self, move_list, level, suffix, keep, priority, callback,
+              *args, token=None):
+        ''' Queue a search of the position after move_list; lower
+        priorities are served first. A CancelToken can take the search
+        out of the queue or stop it. '''
+        self._serial += 1
+        entry = [priority, self._serial,
+                 [list(move_list), level, suffix, keep, callback, args,
+                  token]]
+        heapq.heappush(self._queue, entry)
+        if token is not None:
+            token._interrupt = partial(self._interrupt, entry)
+        self._dispatch()
+
+    def _interrupt(self, entry):
+        ''' A queued search has been called off, or must move now. A
+        cancelled search is taken out of the queue; one that must move
+        is still owed a move, so the less urgent searches under way are
+        told to move now, and it goes to the first session they free. '''
+        if entry not in self._queue:
+            return
+        callback, args, token = entry[2][4:]
+        if token.cancelled:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            token._interrupt = None
+            callback([], *args)
+            return
+        for session, running in list(self._running.items()):
+            if running[0] > entry[0]:
+                if running[2][6] is not None:
+                    running[2][6].move_now()
+                else:
+                    session.interrupt()
+
+    def _dispatch(self):
+        ''' Start queued searches on idle sessions. '''
+        while len(self._queue) > 0:
+            move_list = self._queue[0][2][0]
+            session = self._session_for(move_list)
+            if session is None:
+                return
+            entry = heapq.heappop(self._queue)
+            move_list, level, suffix, keep, callback, args, token = entry[2]
+            self._running[session] = entry
+            session.sync(move_list)
+            session.think(level, suffix, keep, self._thought_cb, session,
+                          callback, args, token=token)
+
+    def _thought_cb(self, events, session, callback, args):
+        self._running.pop(session, None)
+        callback(events, *args)
+        self._dispatch()
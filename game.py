@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+'''
+game.py holds the game itself: the moves played, the board they lead
+to and the gnuchess sessions that play the robot's moves and find
+hints. It knows nothing of GTK, so it can be run without a display;
+whoever shows the game listens for its events:
+
+    status (text)                 something to tell the player
+    position (squares)            the board has changed
+    moved (san)                   a move was played
+    illegal (move)                a move was refused
+    hint (san)                    the move the robot suggests
+    thinking (busy)               a search started or finished
+    robot-moved (before, after)   the robot has played; the squares
+                                  before and after its move
+'''
+
+import os
+import time
+from functools import partial
+
+from gettext import gettext as _
+
+import logging
+_logger = logging.getLogger('GNUChessActivity')
+
+from engine import EnginePool, CancelToken, PRIORITY_ROBOT, \
+    PRIORITY_HINT, PRIORITY_ANALYSIS, DEFAULT_THINK_TIME, MOVE, RESULT, \
+    robot_move, search_result, result_output, parse_output, time_control
+from board import Board
+from movegen import Position
+from cache import PositionCache, DiskCache
+
+ROBOT = 'robot'
+RESTORE = 'restore'
+REMOVE = 'remove'
+UNDO = 'undo'
+HINT = 'hint'
+GAME = 'game'
+NEW = 'new'
+PONDER = 'ponder'
+# The strength ladder: name, search depth (0: as deep as time allows),
+# most seconds the robot may think over a move and whether it may use
+# its opening book. gnuchess 5 has no node limit, so the depth and the
+# time between them bound the CPU spent on a move.
+STRENGTHS = [(_('Novice'), 1, 1, False),
+             (_('Beginner'), 2, 1, False),
+             (_('Casual'), 3, 2, True),
+             (_('Club player'), 5, 3, True),
+             (_('Strong'), 8, 5, True),
+             (_('Expert'), 0, 10, True)]
+# where the easy and hard buttons put the ladder
+MODE_STRENGTHS = {'easy': 0, 'hard': len(STRENGTHS) - 1}
+ROBOT_SHARE = 0.5  # of the time per move on the timer
+ENGINES = 2  # gnuchess processes kept warm for searches
+
+
+def hint_level(ply):
+    ''' The commands for a hint in the position after ply half moves:
+    may as well get a good one '''
+    return 'easy\nbook on\ndepth 0\n' + \
+        time_control(DEFAULT_THINK_TIME, ply)
+
+
+def strength_level(strength, seconds=None, ply=0):
+    ''' The commands that set gnuchess to a rung of the strength ladder,
+    thinking for at most the given number of seconds (by default, what
+    the rung allows) over the position after ply half moves. Every
+    level sets the depth and time control, since gnuchess keeps them
+    from one search to the next; the depth goes last, as 'level' clears
+    it. gnuchess is left in easy mode: it never
+    thinks on its opponent's time. '''
+    name, depth, most, book = STRENGTHS[strength]
+    if seconds is None or seconds > most:
+        seconds = most
+    return 'easy\nbook %s\n' % ('on' if book else 'off') + \
+        time_control(seconds, ply) + 'depth %d\n' % (depth)
+
+
+class Settings():
+    ''' How the game is played. The activity has the same attributes
+    and is passed in its place. With ponder, the robot finds the hint
+    and its reply to it while the human thinks; those searches run in
+    the background, which takes a GLib main loop (without one every
+    search would hold up the game). '''
+
+    def __init__(self, playing_white=True, playing_robot=True,
+                 playing_mode='easy', strength=None, time_interval=None,
+                 ponder=False):
+        self.playing_white = playing_white
+        self.playing_robot = playing_robot
+        self.playing_mode = playing_mode
+        self.strength = strength
+        self.time_interval = time_interval
+        self.ponder = ponder
+
+
+class GameController():
+    ''' The moves of a game, the board and the robot '''
+
+    def __init__(self, binary, settings=None, data_path=None,
+                 engines=ENGINES, transcript=None):
+        if settings is None:
+            settings = Settings()
+        self.settings = settings
+        self._listeners = {}
+
+        self.move_list = []
+        self.game = ''
+        self.check = False
+        self.checkmate = False
+        self.valid_move = False
+        self.thinking = False
+        self.generation = 0
+
+        self._position = Board()  # follows move_list without gnuchess
+        self._cache = PositionCache()  # searches gnuchess has done
+        # cache key -> [CancelToken, those waiting] for each search
+        self._searching = {}
+        self.think_times = []  # (robot move, seconds taken)
+        self._disk_cache = None  # and those done in earlier sessions
+        if data_path is not None:
+            try:
+                self._disk_cache = DiskCache(
+                    os.path.join(data_path, 'positions.cache'))
+            except (OSError, ValueError) as e:
+                _logger.debug('no position cache on disk: %s' % (e))
+        self._before = []
+        self._robot_started = 0
+        self._engine = EnginePool(binary, size=engines,
+                                  transcript=transcript)
+
+    def connect(self, event, callback, *args):
+        ''' Call callback(*values, *args) whenever event happens '''
+        self._listeners.setdefault(event, []).append((callback, args))
+
+    def _emit(self, event, *values):
+        for callback, args in self._listeners.get(event, []):
+            callback(*(values + args))
+
+    def close(self):
+        ''' Shut down the gnuchess sessions. '''
+        self._engine.close()
+        if self._disk_cache is not None:
+            self._disk_cache.close()
+
+    @property
+    def squares(self):
+        ''' The board after move_list, a8 first '''
+        self._position.sync(self.move_list)
+        return self._position.squares
+
+    def move(self, my_move, done=None):
+        ''' Send a command to gnuchess. Searches (ROBOT and HINT) run in
+        the background and call done() when they are finished. '''
+        if my_move == HINT:
+            level = hint_level(len(self.move_list))
+        else:
+            level = self._level()
+
+        if my_move in [REMOVE, UNDO, RESTORE, HINT, GAME, NEW]:
+            if my_move == REMOVE:
+                self.move_list = self.move_list[:-2]
+            elif my_move == UNDO:
+                self.move_list = self.move_list[:-1]
+            if my_move == HINT:
+                self._think(level, DEFAULT_THINK_TIME, False, PRIORITY_HINT,
+                            None, True, done)
+                return
+            elif my_move == GAME:
+                self.game = self._engine.game(self.move_list)
+            else:
+                # gnuchess catches up with move_list on its next command.
+                self._show_position()
+        elif my_move == ROBOT:  # Ask the computer to play
+            self._think(level, self._think_time(), True, PRIORITY_ROBOT,
+                        ROBOT, False, done)
+        elif my_move is not None:  # human's move
+            # Checked and played here; gnuchess is told when it next
+            # has to search.
+            self._play(my_move)
+
+    def _play(self, my_move):
+        ''' Play a human's move (e.g. e2e4, e7e8Q or Nf3) in the board
+        model, recording it in move_list as SAN. '''
+        self.check = False
+        self.checkmate = False
+        self.valid_move = False
+        move = None
+        try:
+            self._position.sync(self.move_list)
+            frm, to, promotion = self._position.parse(my_move)
+            position = Position.from_board(self._position)
+            move = position.legal_move(frm, to, promotion)
+        except ValueError as e:
+            _logger.debug('cannot play %s: %s' % (my_move, e))
+        if move is None:
+            self._emit('illegal', my_move)
+            return
+        san = position.san(move)
+        self.move_list.append(san)
+        self.valid_move = True
+        # Searches for the last position are of no use now, but the
+        # robot's reply to this move may already be under way.
+        self._cancel_searches(keep=self._key(self.move_list, self._level()))
+        if '+' in san:
+            self.check = True
+        if '#' in san:
+            self.checkmate = True
+        self._emit('moved', san)
+        self._show_position()
+        self._ponder()
+
+    def _strength(self):
+        ''' The robot's rung on the strength ladder '''
+        strength = self.settings.strength
+        if strength is None or strength < 0 or strength >= len(STRENGTHS):
+            return MODE_STRENGTHS.get(self.settings.playing_mode,
+                                      len(STRENGTHS) - 1)
+        return strength
+
+    def _level(self, ply=None):
+        ''' The commands that set the robot's strength and pace for the
+        position after ply half moves (by default, the current one);
+        thinking on the human's time is done by pondering here. '''
+        if ply is None:
+            ply = len(self.move_list)
+        return strength_level(self._strength(), self._think_time(), ply)
+
+    def _think_time(self):
+        ''' Seconds the robot may take over a move: what its strength
+        allows, or a share of the time per move on the timer if that is
+        less '''
+        seconds = STRENGTHS[self._strength()][2]
+        if self.settings.time_interval and \
+           self.settings.time_interval > 0:
+            return min(seconds, self.settings.time_interval * ROBOT_SHARE)
+        return seconds
+
+    def _key(self, move_list, level):
+        ''' The cache key for a search of the position after move_list '''
+        try:
+            if move_list == self.move_list:
+                board = self._position
+            else:
+                board = self._position.copy()
+            board.sync(move_list)
+        except ValueError:
+            return None
+        return (board.hash, level)
+
+    def _cached(self, key):
+        ''' A search already done, from memory or from disk '''
+        if key is None:
+            return None
+        events = self._cache.get(key)
+        if events is None and self._disk_cache is not None:
+            output = self._disk_cache.get(key)
+            if output is not None:
+                events = parse_output(output)
+                self._cache.put(key, events)
+        _logger.debug('position cache: %d hits, %d misses' %
+                      (self._cache.hits, self._cache.misses))
+        return events
+
+    def _think(self, level, seconds, keep, priority, my_move, hint, done,
+               move_list=None):
+        ''' Search the position after move_list (by default, the current
+        one), unless gnuchess has already searched it at this level or is
+        searching it now. After the given number of seconds, gnuchess
+        must move however its search is going. '''
+        if move_list is None:
+            move_list = self.move_list
+        key = self._key(move_list, level)
+        events = self._cached(key)
+        if events is not None:
+            # gnuchess catches up with the move on its next command.
+            self._think_cb(events, self.generation, my_move, hint, done)
+            return
+        if key in self._searching:  # most likely while pondering
+            self._searching[key][1].append((self.generation, my_move, hint,
+                                            done))
+            return
+        token = CancelToken(timeout=seconds)
+        if key is not None:
+            self._searching[key] = [token, []]
+        self._engine.think(move_list, level, '', keep, priority,
+                           self._think_cb, self.generation, my_move, hint,
+                           done, key, token, token=token)
+
+    def _cancel_searches(self, keep=None):
+        ''' Stop every search but the one for key keep; anyone waiting for
+        them gets an empty reply. '''
+        for key in list(self._searching.keys()):
+            if key == keep:
+                continue
+            token, waiting = self._searching.pop(key)
+            token.cancel()
+            for waiter in waiting:
+                self._think_cb([], *waiter)
+
+    def start_thinking(self):
+        ''' The robot (or the hint) is on its way '''
+        self.thinking = True
+        self._emit('thinking', True)
+
+    def _done_thinking(self):
+        self.thinking = False
+        self._emit('thinking', False)
+
+    def stop_thinking(self):
+        ''' Drop the searches for the game as it was. '''
+        self.generation += 1
+        self._cancel_searches()
+        if self.thinking:
+            self._done_thinking()
+
+    def time_up(self):
+        ''' The timer has run out: if the robot is thinking, it must move
+        now. '''
+        key = self._key(self.move_list, self._level())
+        if self.robot_to_move() and key in self._searching:
+            self._searching[key][0].move_now()
+
+    def reply_ready(self):
+        ''' Has the robot's reply to the current position already been
+        found, most likely by pondering? '''
+        return self._key(self.move_list, self._level()) in self._cache
+
+    def robot_to_move(self):
+        return self.settings.playing_robot and \
+            self.settings.playing_white == (len(self.move_list) % 2 == 1)
+
+    def _ponder(self):
+        ''' While a human is thinking, work out their hint, which is also
+        our guess at their move, and then (when playing the robot) search
+        the robot's reply to it. Both answers wait in the cache. '''
+        if not self.settings.ponder or self.checkmate or \
+           self.robot_to_move():
+            return
+        self._think(hint_level(len(self.move_list)), DEFAULT_THINK_TIME,
+                    False, PRIORITY_ANALYSIS, PONDER, False,
+                    partial(self._pondered, self.move_list[:]))
+
+    def _pondered(self, move_list, events):
+        move = robot_move(events)
+        if move is None or move_list != self.move_list:
+            return  # The human has not waited for us.
+        if self.settings.ponder and self.settings.playing_robot:
+            self._think(self._level(len(move_list) + 1),
+                        self._think_time(), False, PRIORITY_ANALYSIS, PONDER,
+                        False, None, move_list + [move])
+
+    def _think_cb(self, events, generation, my_move, hint, done, key=None,
+                  token=None):
+        ''' gnuchess has finished searching '''
+        if key is not None:
+            if robot_move(events) is not None:
+                # Worth keeping even if the game has moved on
+                result = search_result(events)
+                self._cache.put(key, result)
+                if self._disk_cache is not None:
+                    self._disk_cache.put(key, result_output(result))
+            if key in self._searching and self._searching[key][0] is token:
+                for waiting in self._searching.pop(key)[1]:
+                    self._think_cb(events, *waiting)
+        if my_move == PONDER:
+            if generation == self.generation and done is not None:
+                done(events)
+            return
+        if generation != self.generation or len(events) == 0:
+            # The game has moved on (or gnuchess went away)
+            if generation == self.generation:
+                self._done_thinking()
+                self._emit('status', '???')
+            return
+        self._process_output(events, my_move=my_move, hint=hint)
+        if done is not None:
+            done()
+
+    def _process_output(self, events, my_move=None, hint=False):
+        ''' process the events of a gnuchess reply '''
+        self.check = False
+        self.checkmate = False
+        self.valid_move = False
+        move = None
+        result = None
+        for kind, value in events:
+            if kind == MOVE:
+                move = value
+            elif kind == RESULT:
+                result = value
+        if hint:  # What would the robot do?
+            self._done_thinking()
+            if move is not None:
+                self._emit('hint', move)
+            return
+        elif my_move == ROBOT:
+            if result is not None and result[0] != '1/2-1/2':
+                self.checkmate = True
+            if move is not None:
+                self.move_list.append(move)
+                self.valid_move = True
+                if '+' in move:
+                    self.check = True
+                if '#' in move or '++' in move:
+                    self.checkmate = True
+                self._emit('moved', move)
+            self._done_thinking()
+
+        self._show_position()
+
+    def _show_position(self):
+        ''' Bring the board model up to move_list and tell the view '''
+        try:
+            self._position.sync(self.move_list)
+        except ValueError as e:
+            _logger.debug('cannot follow %s: %s' % (self.move_list, e))
+            self._emit('status', '???')
+            return
+        self._emit('position', self._position.squares)
+
+    def move_squares(self, move):
+        ''' The squares a move (in SAN) in the current position goes
+        from and to, or None '''
+        try:
+            self._position.sync(self.move_list)
+            frm, to, promotion = Position.from_board(
+                self._position).parse_san(move)
+        except ValueError as e:
+            _logger.debug('cannot find %s: %s' % (move, e))
+            return None
+        return frm, to
+
+    def clear(self):
+        ''' Things to reinitialize when starting up a new game. '''
+        self.stop_thinking()
+        self.move_list = []
+        self.game = ''
+        self.think_times = []
+        self.check = False
+        self.checkmate = False
+
+    def new_game(self):
+        self.clear()
+        self.move(NEW)
+        if self.robot_to_move():
+            self.start_thinking()
+            self.robot_move()
+        else:
+            self._ponder()
+
+    def restore_game(self, move_list):
+        self.stop_thinking()
+        self.move_list = [str(move) for move in move_list]
+        self.move(RESTORE)
+        self._ponder()
+
+    def robot_move(self, generation=None):
+        ''' Let the robot play, unless the game has been taken back
+        since this was asked for '''
+        if generation is not None and generation != self.generation:
+            return False
+        self._position.sync(self.move_list)
+        self._before = self._position.squares[:]
+        self._robot_started = time.time()
+        self.move(ROBOT, done=self._robot_moved)
+        return False
+
+    def _robot_moved(self):
+        after = self._position.squares[:]
+        if after == self._before:
+            # Game is over
+            return
+        self.think_times.append((self.move_list[-1],
+                                 time.time() - self._robot_started))
+        _logger.debug('robot played %s in %.2f seconds' %
+                      self.think_times[-1])
+        self._ponder()
+        self._emit('robot-moved', self._before, after)
+
+    def undo(self):
+        ''' Take back the last move, or (against the robot) the last move
+        and the robot's reply '''
+        self.stop_thinking()
+        if self.settings.playing_robot and len(self.move_list) > 1:
+            if self.settings.playing_white:
+                if len(self.move_list) % 2 == 0:
+                    self.move(REMOVE)
+                else:
+                    self.move(UNDO)
+            else:
+                if len(self.move_list) % 2 == 1:
+                    self.move(REMOVE)
+                else:
+                    self.move(UNDO)
+        elif len(self.move_list) > 0:
+            self.move(UNDO)
+        self._ponder()
+
+    def hint(self):
+        ''' Find the robot's choice in the current position. Usually
+        answered at once from the cache, or by a search that is already
+        under way. '''
+        self.start_thinking()
+        self.move(HINT)
+
+    def copy_game(self):
+        self.move(GAME)
+        return self.game
+
+    def save_game(self):
+        return self.move_list
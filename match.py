@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+'''
+match.py plays gnuchess against itself at two rungs of the strength
+ladder, to see how far apart the rungs are and how fast a machine gets
+through games. The games are shared among a pool of worker processes,
+each with a gnuchess session for either side; the two strengths swap
+colours every game, and the first few plies are picked at random so
+the games differ.
+
+    python3 match.py [-n GAMES] [-j JOBS] [-a STRENGTH] [-b STRENGTH]
+                     [-o FILE.pgn]
+
+Strengths are numbered from 0 (the bottom of the ladder) and are in
+game.py.
+'''
+
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+from engine import EngineSession, CancelToken, find_binary, \
+    MOVE, RESULT
+from game import STRENGTHS, strength_level
+from board import Board
+from movegen import Position
+
+MAX_PLIES = 300  # a game still going after this many plies is a draw
+RANDOM_PLIES = 2
+SCORES = {'1-0': (1, 0), '0-1': (0, 1), '1/2-1/2': (0.5, 0.5)}
+
+_sessions = None  # each worker's gnuchess sessions, one for each side
+
+
+def _start_worker(binary):
+    global _sessions
+    _sessions = [EngineSession(binary), EngineSession(binary)]
+    for session in _sessions:
+        session.start()
+
+
+def play_game(job):
+    ''' Play one game in a worker. job is (round, white strength, black
+    strength, seed); the result is a dictionary with the moves, the
+    result, why the game ended and how long each search took. '''
+    number, white, black, seed = job
+    rand = random.Random(seed)
+    # gnuchess searching to a set depth pays no heed to the clock
+    seconds = [STRENGTHS[white][2], STRENGTHS[black][2]]
+    moves = []
+    board = Board()
+    position = Position.from_board(board)
+    for ply in range(RANDOM_PLIES):
+        move = rand.choice(position.legal_moves())
+        moves.append(position.san(move))
+        position = position.play(move)
+    board.sync(moves)
+    latencies = []
+    result, reason = '*', ''
+    while result == '*':
+        if len(moves) >= MAX_PLIES:
+            result, reason = '1/2-1/2', 'move limit'
+            break
+        session = _sessions[len(moves) % 2]
+        session.sync(moves)
+        start = time.time()
+        level = strength_level([white, black][len(moves) % 2],
+                               ply=len(moves))
+        events = session.think(level, token=CancelToken(
+            timeout=seconds[len(moves) % 2]))
+        latencies.append(time.time() - start)
+        move = None
+        for kind, value in events:
+            if kind == MOVE:
+                move = value
+            elif kind == RESULT:
+                result, reason = value
+        if move is None:
+            if result == '*':
+                reason = 'no move'
+            break
+        try:
+            board.push(move)
+        except ValueError:
+            result, reason = '*', 'cannot follow %s' % (move)
+            break
+        moves.append(move)
+    return {'round': number, 'white': white, 'black': black,
+            'moves': moves, 'result': result, 'reason': reason,
+            'latencies': latencies}
+
+
+def pgn(game, date):
+    ''' A game in PGN '''
+    tags = [('Event', 'gnuchess match'), ('Site', '?'),
+            ('Date', time.strftime('%Y.%m.%d', date)),
+            ('Round', str(game['round'])),
+            ('White', 'gnuchess (%s)' % (STRENGTHS[game['white']][0])),
+            ('Black', 'gnuchess (%s)' % (STRENGTHS[game['black']][0])),
+            ('Result', game['result'])]
+    if game['reason']:
+        tags.append(('Termination', game['reason']))
+    text = ''.join(['[%s "%s"]\n' % tag for tag in tags]) + '\n'
+    words = []
+    for i, move in enumerate(game['moves']):
+        if i % 2 == 0:
+            words.append('%d.' % (i // 2 + 1))
+        words.append(move)
+    words.append(game['result'])
+    line = ''
+    for word in words:
+        if len(line) + len(word) + 1 > 79:
+            text += line + '\n'
+            line = word
+        else:
+            line = word if line == '' else line + ' ' + word
+    return text + line + '\n\n'
+
+
+def match(games, jobs, a, b, output=None, binary=None, seed=None):
+    ''' Play games between strengths a and b; report the score and the
+    pace '''
+    if seed is None:
+        seed = random.randrange(1 << 30)
+    work = []
+    for i in range(games):
+        if i % 2 == 0:
+            work.append((i + 1, a, b, seed + i))
+        else:
+            work.append((i + 1, b, a, seed + i))
+    date = time.localtime()
+    score = {a: 0, b: 0} if a != b else {a: 0}
+    latencies = []
+    start = time.time()
+    pool = multiprocessing.Pool(jobs, _start_worker,
+                                (binary or find_binary(),))
+    try:
+        for game in pool.imap_unordered(play_game, work):
+            white, black = SCORES.get(game['result'], (0, 0))
+            score[game['white']] += white
+            score[game['black']] += black
+            latencies += game['latencies']
+            print('%3d. %s - %s: %s (%d plies%s)' %
+                  (game['round'], STRENGTHS[game['white']][0],
+                   STRENGTHS[game['black']][0], game['result'],
+                   len(game['moves']),
+                   ', ' + game['reason'] if game['reason'] else ''))
+            if output is not None:
+                output.write(pgn(game, date))
+                output.flush()
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    for strength in score:
+        print('%s: %.1f/%d' % (STRENGTHS[strength][0], score[strength],
+                               games))
+    print('%d games in %.1fs on %d workers: %.0f games/hour' %
+          (games, elapsed, jobs, games * 3600 / max(elapsed, 1e-9)))
+    if len(latencies) > 0:
+        print('%d searches, %.0f ms on average, %.0f ms at most' %
+              (len(latencies), 1000 * sum(latencies) / len(latencies),
+               1000 * max(latencies)))
+    return score
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0], description='Play gnuchess against itself.')
+    parser.add_argument('-n', '--games', type=int, default=10)
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('-a', type=int, default=0,
+                        help='strength of one side (0-%d)' %
+                        (len(STRENGTHS) - 1))
+    parser.add_argument('-b', type=int, default=1,
+                        help='strength of the other side')
+    parser.add_argument('-o', '--output', help='write the games as PGN')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--engine')
+    args = parser.parse_args(argv[1:])
+    for strength in [args.a, args.b]:
+        if strength < 0 or strength >= len(STRENGTHS):
+            parser.error('no strength %d' % (strength))
+    output = None
+    if args.output is not None:
+        output = open(args.output, 'w')
+    try:
+        match(args.games, max(1, args.jobs), args.a, args.b, output,
+              args.engine, args.seed)
+    finally:
+        if output is not None:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+'''
+movegen.py generates legal moves, so a move can be checked without
+asking gnuchess. Bit i of a bitboard is square i, numbered as in
+board.py (0 is a8, 63 is h1). Sliding attacks are looked up in
+precomputed ray tables, cut short at the first blocker.
+
+Run "python3 movegen.py perft [depth]" to count the leaf nodes of
+some standard test positions and report nodes/second. sanbench.py
+times decoding SAN.
+'''
+
+import sys
+import time
+
+from board import EMPTY, FILES, RANKS, CASTLES, square
+
+PIECES = 'PNBRQKpnbrqk'
+INDEX = dict([(p, i) for i, p in enumerate(PIECES)])
+WHITE = 0
+BLACK = 1
+PROMOTIONS = 'QRBN'
+# Row and column steps of the sliding pieces
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1),  # rook
+              (-1, -1), (-1, 1), (1, -1), (1, 1)]  # bishop
+ROOK_DIRECTIONS = [0, 1, 2, 3]
+BISHOP_DIRECTIONS = [4, 5, 6, 7]
+# Squares the king crosses (which must not be attacked) and the squares
+# that must be empty, for each castle
+CASTLE_PATHS = {'K': ([60, 61, 62], [61, 62]),
+                'Q': ([60, 59, 58], [59, 58, 57]),
+                'k': ([4, 5, 6], [5, 6]),
+                'q': ([4, 3, 2], [3, 2, 1])}
+
+# (fen, leaf counts at depth 1, 2, ...)
+PERFT_POSITIONS = [
+    ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -',
+     [20, 400, 8902, 197281, 4865609]),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq -',
+     [48, 2039, 97862, 4085603]),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - -',
+     [14, 191, 2812, 43238, 674624]),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq -',
+     [6, 264, 9467, 422333]),
+    ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ -',
+     [44, 1486, 62379, 2103487]),
+]
+
+
+def _bit(row, col):
+    if row < 0 or row > 7 or col < 0 or col > 7:
+        return 0
+    return 1 << (row * 8 + col)
+
+
+def _tables():
+    ''' Attack masks for the pieces that do not slide, and the ray from
+    each square in each direction. '''
+    knight = []
+    king = []
+    pawn = [[], []]
+    rays = [[] for d in DIRECTIONS]
+    for i in range(64):
+        row, col = i // 8, i % 8
+        bits = 0
+        for dr, dc in [(-2, -1), (-2, 1), (-1, -2), (-1, 2),
+                       (1, -2), (1, 2), (2, -1), (2, 1)]:
+            bits |= _bit(row + dr, col + dc)
+        knight.append(bits)
+        bits = 0
+        for dr, dc in DIRECTIONS:
+            bits |= _bit(row + dr, col + dc)
+        king.append(bits)
+        pawn[WHITE].append(_bit(row - 1, col - 1) | _bit(row - 1, col + 1))
+        pawn[BLACK].append(_bit(row + 1, col - 1) | _bit(row + 1, col + 1))
+        for d, (dr, dc) in enumerate(DIRECTIONS):
+            bits = 0
+            r, c = row + dr, col + dc
+            while _bit(r, c):
+                bits |= _bit(r, c)
+                r, c = r + dr, c + dc
+            rays[d].append(bits)
+    return knight, king, pawn, rays
+
+
+KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, RAYS = _tables()
+FORWARD = [dr * 8 + dc > 0 for dr, dc in DIRECTIONS]
+FILE_MASKS = dict([(f, sum([1 << (r * 8 + c) for r in range(8)]))
+                   for c, f in enumerate(FILES)])
+RANK_MASKS = dict([(RANKS[7 - r], 0xff << (r * 8)) for r in range(8)])
+
+
+def slide(i, occupied, directions):
+    ''' The squares a slider on i attacks, stopping at the first piece in
+    each direction. '''
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][i]
+        blockers = ray & occupied
+        if blockers:
+            if FORWARD[d]:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= RAYS[d][first]
+        attacks |= ray
+    return attacks
+
+
+def squares_of(bits):
+    ''' The squares set in a bitboard, lowest first '''
+    found = []
+    while bits:
+        low = bits & -bits
+        found.append(low.bit_length() - 1)
+        bits ^= low
+    return found
+
+
+class Position():
+    ''' A position as bitboards, one per piece type and colour. Moves are
+    (from, to, promotion) tuples, promotion being None or one of 'QRBN'. '''
+
+    __slots__ = ['squares', 'pieces', 'occupied', 'white_to_move',
+                 'castling', 'ep']
+
+    def __init__(self, squares=None, white_to_move=True, castling='KQkq',
+                 ep=None):
+        if squares is None:
+            squares = list('rnbqkbnr' + 'p' * 8 + EMPTY * 32 + 'P' * 8 +
+                           'RNBQKBNR')
+        self.squares = list(squares)
+        self.white_to_move = white_to_move
+        self.castling = castling
+        self.ep = ep
+        self.pieces = [0] * 12
+        self.occupied = [0, 0]
+        for i, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                k = INDEX[piece]
+                self.pieces[k] |= 1 << i
+                self.occupied[k // 6] |= 1 << i
+
+    @classmethod
+    def from_board(cls, board):
+        ''' The position held by a board.Board '''
+        return cls(board.squares, board.white_to_move, board.castling,
+                   board.ep)
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        squares = []
+        for c in fields[0]:
+            if c.isdigit():
+                squares += [EMPTY] * int(c)
+            elif c != '/':
+                squares.append(c)
+        castling = fields[2] if len(fields) > 2 and fields[2] != '-' else ''
+        ep = None
+        if len(fields) > 3 and fields[3] != '-':
+            ep = square(fields[3])
+        return cls(squares, fields[1] == 'w', castling, ep)
+
+    def attacked(self, i, by_white):
+        ''' Is square i attacked by one side? '''
+        pieces = self.pieces
+        them = 0 if by_white else 6
+        # A pawn of ours on i would attack the squares their pawns
+        # attack i from.
+        if PAWN_ATTACKS[BLACK if by_white else WHITE][i] & pieces[them]:
+            return True
+        if KNIGHT_ATTACKS[i] & pieces[them + 1]:
+            return True
+        if KING_ATTACKS[i] & pieces[them + 5]:
+            return True
+        occupied = self.occupied[0] | self.occupied[1]
+        queens = pieces[them + 4]
+        if slide(i, occupied, ROOK_DIRECTIONS) & (pieces[them + 3] | queens):
+            return True
+        if slide(i, occupied, BISHOP_DIRECTIONS) & \
+           (pieces[them + 2] | queens):
+            return True
+        return False
+
+    def in_check(self, white=None):
+        ''' Is the king of one side (by default, the side to move) in
+        check? '''
+        if white is None:
+            white = self.white_to_move
+        king = self.pieces[5 if white else 11]
+        return self.attacked(king.bit_length() - 1, not white)
+
+    def pseudo_legal_moves(self):
+        ''' Every move, including those that leave the king in check '''
+        moves = []
+        white = self.white_to_move
+        us = WHITE if white else BLACK
+        base = 6 * us
+        own = self.occupied[us]
+        theirs = self.occupied[1 - us]
+        occupied = own | theirs
+        pieces = self.pieces
+
+        # Pawns
+        step = -8 if white else 8
+        start = range(48, 56) if white else range(8, 16)
+        last = range(0, 8) if white else range(56, 64)
+        ep = 0 if self.ep is None else 1 << self.ep
+        for frm in squares_of(pieces[base]):
+            targets = PAWN_ATTACKS[us][frm] & (theirs | ep)
+            to = frm + step
+            if not (occupied >> to) & 1:
+                targets |= 1 << to
+                if frm in start and not (occupied >> (to + step)) & 1:
+                    targets |= 1 << (to + step)
+            for to in squares_of(targets):
+                if to in last:
+                    for promotion in PROMOTIONS:
+                        moves.append((frm, to, promotion))
+                else:
+                    moves.append((frm, to, None))
+
+        for frm in squares_of(pieces[base + 1]):
+            for to in squares_of(KNIGHT_ATTACKS[frm] & ~own):
+                moves.append((frm, to, None))
+        for frm in squares_of(pieces[base + 2] | pieces[base + 4]):
+            for to in squares_of(slide(frm, occupied, BISHOP_DIRECTIONS) &
+                                 ~own):
+                moves.append((frm, to, None))
+        for frm in squares_of(pieces[base + 3] | pieces[base + 4]):
+            for to in squares_of(slide(frm, occupied, ROOK_DIRECTIONS) &
+                                 ~own):
+                moves.append((frm, to, None))
+        for frm in squares_of(pieces[base + 5]):
+            for to in squares_of(KING_ATTACKS[frm] & ~own):
+                moves.append((frm, to, None))
+
+        for side in ('KQ' if white else 'kq'):
+            if side not in self.castling:
+                continue
+            crossed, empty = CASTLE_PATHS[side]
+            if any([(occupied >> i) & 1 for i in empty]):
+                continue
+            if self.squares[CASTLES[side][2]] != ('R' if white else 'r'):
+                continue
+            if any([self.attacked(i, not white) for i in crossed]):
+                continue
+            moves.append((CASTLES[side][0], CASTLES[side][1], None))
+        return moves
+
+    def legal_moves(self):
+        ''' Every move that does not leave the mover's king in check '''
+        white = self.white_to_move
+        return [move for move in self.pseudo_legal_moves()
+                if not self.play(move).in_check(white)]
+
+    def legal_move(self, frm, to, promotion=None):
+        ''' The move frm-to if the side to move can play it, else None. A
+        missing promotion piece is taken to be a queen. '''
+        if self.squares[frm] in 'Pp' and (to < 8 or to > 55) and \
+           promotion is None:
+            promotion = 'Q'
+        move = (frm, to, promotion)
+        if move not in self.pseudo_legal_moves() or \
+           self.play(move).in_check(self.white_to_move):
+            return None
+        return move
+
+    def is_legal(self, frm, to, promotion=None):
+        ''' Can the side to move play frm-to? '''
+        return self.legal_move(frm, to, promotion) is not None
+
+    def parse_san(self, san):
+        ''' The (from, to, promotion) move written san, e.g. Nbd7, exd5,
+        e8=Q or O-O. The source square is found by looking up what
+        attacks the target square, so no squares are searched. Raises
+        ValueError if no one move matches. '''
+        white = self.white_to_move
+        san = san.rstrip('+#!?')
+        if san in ['O-O', '0-0', 'O-O-O', '0-0-0']:
+            if white:
+                side = 'K' if len(san) == 3 else 'Q'
+            else:
+                side = 'k' if len(san) == 3 else 'q'
+            return CASTLES[side][0], CASTLES[side][1], None
+        promotion = None
+        if '=' in san:
+            san, promotion = san.split('=')
+            promotion = promotion.upper()
+        elif len(san) > 2 and san[-1] in PROMOTIONS and san[-2] in RANKS:
+            promotion = san[-1]
+            san = san[:-1]
+        if len(san) < 2 or san[-2] not in FILES or san[-1] not in RANKS:
+            raise ValueError('bad move %s' % (san))
+        to = square(san[-2:])
+        source = san[:-2].replace('x', '')
+        piece = 'P'
+        if len(source) > 0 and source[0] in 'KQRBN':
+            piece = source[0]
+            source = source[1:]
+        k = INDEX[piece] + (0 if white else 6)
+        occupied = self.occupied[0] | self.occupied[1]
+        if piece == 'P':
+            if len(source) > 0:  # a capture, e.g. exd5
+                candidates = PAWN_ATTACKS[BLACK if white else WHITE][to]
+            else:
+                behind = to + (8 if white else -8)
+                candidates = 1 << behind
+                if not (occupied >> behind) & 1 and \
+                   to // 8 == (4 if white else 3):
+                    candidates = 1 << (behind + (8 if white else -8))
+            if promotion is None and (to < 8 or to > 55):
+                promotion = 'Q'
+        elif piece == 'N':
+            candidates = KNIGHT_ATTACKS[to]
+        elif piece == 'B':
+            candidates = slide(to, occupied, BISHOP_DIRECTIONS)
+        elif piece == 'R':
+            candidates = slide(to, occupied, ROOK_DIRECTIONS)
+        elif piece == 'Q':
+            candidates = slide(to, occupied,
+                               ROOK_DIRECTIONS + BISHOP_DIRECTIONS)
+        else:
+            candidates = KING_ATTACKS[to]
+        candidates &= self.pieces[k]
+        for c in source:
+            if c in FILES:
+                candidates &= FILE_MASKS[c]
+            elif c in RANKS:
+                candidates &= RANK_MASKS[c]
+        moves = [(frm, to, promotion) for frm in squares_of(candidates)]
+        if len(moves) > 1:  # a pinned piece cannot be the one that moved
+            moves = [move for move in moves
+                     if not self.play(move).in_check(white)]
+        if len(moves) != 1:
+            raise ValueError('cannot play %s%s' % (piece, san[-2:]))
+        return moves[0]
+
+    def san(self, move):
+        ''' The move in standard algebraic notation, as gnuchess writes
+        it, with + for check and # for checkmate '''
+        frm, to, promotion = move
+        piece = self.squares[frm].upper()
+        if piece == 'K' and abs(to - frm) == 2:
+            name = 'O-O' if to > frm else 'O-O-O'
+        else:
+            capture = self.squares[to] != EMPTY or \
+                (piece == 'P' and to == self.ep)
+            target = '%s%s' % (FILES[to % 8], RANKS[7 - to // 8])
+            if piece == 'P':
+                name = target
+                if capture:
+                    name = '%sx%s' % (FILES[frm % 8], target)
+                if promotion is not None:
+                    name += '=' + promotion
+            else:
+                others = [m[0] for m in self.legal_moves()
+                          if m[1] == to and m[0] != frm and
+                          self.squares[m[0]] == self.squares[frm]]
+                source = ''
+                if others:
+                    if all([i % 8 != frm % 8 for i in others]):
+                        source = FILES[frm % 8]
+                    elif all([i // 8 != frm // 8 for i in others]):
+                        source = RANKS[7 - frm // 8]
+                    else:
+                        source = FILES[frm % 8] + RANKS[7 - frm // 8]
+                name = piece + source + ('x' if capture else '') + target
+        after = self.play(move)
+        if after.in_check():
+            name += '#' if len(after.legal_moves()) == 0 else '+'
+        return name
+
+    def play(self, move):
+        ''' The position after a move (which is assumed to be possible) '''
+        frm, to, promotion = move
+        position = Position.__new__(Position)
+        squares = self.squares[:]
+        pieces = self.pieces[:]
+        occupied = self.occupied[:]
+        white = self.white_to_move
+        us = WHITE if white else BLACK
+        piece = squares[frm]
+        k = INDEX[piece]
+        frm_bit = 1 << frm
+        to_bit = 1 << to
+
+        captured = squares[to]
+        if captured != EMPTY:
+            pieces[INDEX[captured]] ^= to_bit
+            occupied[1 - us] ^= to_bit
+        pieces[k] ^= frm_bit
+        occupied[us] ^= frm_bit | to_bit
+        squares[frm] = EMPTY
+
+        ep = None
+        if k % 6 == 0:  # pawn
+            if to == self.ep:  # take the pawn that passed
+                i = to + (8 if white else -8)
+                pieces[k + 6 if white else k - 6] ^= 1 << i
+                occupied[1 - us] ^= 1 << i
+                squares[i] = EMPTY
+            elif abs(to - frm) == 16:
+                ep = (to + frm) // 2
+            if promotion is not None:
+                piece = promotion if white else promotion.lower()
+                k = INDEX[piece]
+        elif k % 6 == 5 and abs(to - frm) == 2:  # castle
+            for side in ('KQ' if white else 'kq'):
+                if CASTLES[side][1] == to:
+                    rook_from, rook_to = CASTLES[side][2:]
+                    rook = (1 << rook_from) | (1 << rook_to)
+                    pieces[k - 2] ^= rook
+                    occupied[us] ^= rook
+                    squares[rook_to] = squares[rook_from]
+                    squares[rook_from] = EMPTY
+        pieces[k] |= to_bit
+        squares[to] = piece
+
+        castling = self.castling
+        if castling:
+            for side in castling:
+                if frm in (CASTLES[side][0], CASTLES[side][2]) or \
+                   to == CASTLES[side][2]:
+                    castling = castling.replace(side, '')
+
+        position.squares = squares
+        position.pieces = pieces
+        position.occupied = occupied
+        position.white_to_move = not white
+        position.castling = castling
+        position.ep = ep
+        return position
+
+    def perft(self, depth):
+        ''' Count the positions depth plies from here '''
+        moves = self.legal_moves()
+        if depth <= 1:
+            return len(moves) if depth == 1 else 1
+        nodes = 0
+        for move in moves:
+            nodes += self.play(move).perft(depth - 1)
+        return nodes
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != 'perft':
+        print('usage: %s perft [depth]' % (argv[0]))
+        return 2
+    depth = int(argv[2]) if len(argv) > 2 else 3
+    total_nodes = 0
+    total_time = 0
+    failed = 0
+    for fen, expected in PERFT_POSITIONS:
+        position = Position.from_fen(fen)
+        start = time.time()
+        nodes = position.perft(depth)
+        elapsed = time.time() - start
+        total_nodes += nodes
+        total_time += elapsed
+        if depth <= len(expected) and nodes != expected[depth - 1]:
+            status = 'FAIL (expected %d)' % (expected[depth - 1])
+            failed += 1
+        else:
+            status = 'ok'
+        print('%-66s %9d %7.2fs %9.0f nodes/s %s' %
+              (fen, nodes, elapsed, nodes / max(elapsed, 1e-9), status))
+    print('perft(%d): %d nodes in %.2fs, %.0f nodes/s' %
+          (depth, total_nodes, total_time,
+           total_nodes / max(total_time, 1e-9)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
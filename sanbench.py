@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+'''
+sanbench.py times decoding the SAN moves the activity reads, gnuchess
+replies and game records, with movegen.Position.parse_san against the
+decoder of an older activity, which walked the board looking up sprites
+by their coordinates. It also reports the moves that decoder read
+wrongly.
+
+    python3 sanbench.py TRANSCRIPT BASELINE [rounds]
+
+TRANSCRIPT is a recording (see transcript.py) and BASELINE a chess.py
+from before movegen.py, e.g. the output of "git show e3df1cd^:chess.py".
+'''
+
+import ast
+import sys
+import time
+
+from board import EMPTY, FILES, RANKS, square_name
+import transcript
+
+
+class _Sprite():
+    ''' A piece of the baseline activity: the decoder only asks where it
+    is '''
+
+    def __init__(self, xy=(-1, -1)):
+        self.rect = list(xy)
+
+    def move(self, pos):
+        self.rect[0], self.rect[1] = pos
+
+    def get_xy(self):
+        return (self.rect[0], self.rect[1])
+
+    def get_dimensions(self):
+        return (1, 1)
+
+    def set_layer(self, layer):
+        pass
+
+
+SCANNER_METHODS = ['_parse_move', '_search_for_pawn', '_search_for_rook',
+                   '_search_for_knight', '_search_for_bishop',
+                   '_search_for_queen', '_search_for_king',
+                   '_find_piece_at_index', '_find_piece_at_xy',
+                   '_file_and_rank_to_index', '_index_to_xy']
+# The sprites the baseline kept for each piece of a side
+SPRITE_SLOTS = {'R': [0, 7], 'N': [1, 6], 'B': [2, 5], 'Q': [3, 16],
+                'K': [4], 'P': list(range(8, 16))}
+
+
+def baseline_scanner(path):
+    ''' The SAN decoder of a chess.py from before this module (it walked
+    the board looking up sprites by their coordinates), taken out of its
+    Gtk canvas and set on a board with squares one unit wide. '''
+    with open(path) as fd:
+        source = fd.read()
+    lines = source.split('\n')
+    tree = ast.parse(source)
+    view = [node for node in tree.body if isinstance(node, ast.ClassDef)][0]
+    body = ['class Scanner():']
+    for node in view.body:
+        if isinstance(node, ast.FunctionDef) and \
+           node.name in SCANNER_METHODS:
+            body += lines[node.lineno - 1:node.end_lineno]
+    namespace = {'FILES': FILES, 'RANKS': RANKS, 'MID': 2}
+    exec(compile('\n'.join(body), path, 'exec'), namespace)
+
+    scanner = namespace['Scanner']()
+    scanner.scale = 1
+    scanner._width = 8
+    scanner._board = [_Sprite((i % 8, i // 8)) for i in range(64)]
+    scanner.white = [_Sprite() for i in range(17)]
+    scanner.black = [_Sprite() for i in range(17)]
+    scanner._flash_tile = lambda tiles: setattr(scanner, 'tiles', tiles)
+    return scanner
+
+
+def _place_sprites(scanner, squares):
+    ''' Set the baseline's sprites out as the pieces on squares '''
+    free = {}
+    for sprite in scanner.white + scanner.black:
+        sprite.move((-1, -1))
+    for i, piece in enumerate(squares):
+        if piece == EMPTY:
+            continue
+        sprites = scanner.white if piece.isupper() else scanner.black
+        slots = free.setdefault(piece, list(SPRITE_SLOTS[piece.upper()]))
+        if len(slots) > 0:  # a third rook, say, had no sprite
+            sprites[slots.pop(0)].move((i % 8, i // 8))
+
+
+def san_benchmark(path, baseline, rounds=100):
+    ''' Time decoding the moves of a transcript (gnuchess replies and
+    game records) with parse_san and with the baseline decoder '''
+    pairs = transcript.decoded_moves(transcript.load(path))
+    scanner = baseline_scanner(baseline)
+    start = time.time()
+    for i in range(rounds):
+        for position, san in pairs:
+            position.parse_san(san)
+    table_time = time.time() - start
+    scan_time = 0
+    differ = 0
+    for position, san in pairs:
+        scanner.move_list = [] if position.white_to_move else [None]
+        _place_sprites(scanner, position.squares)
+        start = time.time()
+        for i in range(rounds):
+            scanner._parse_move(san.rstrip('+#'))
+        scan_time += time.time() - start
+        # The baseline showed castling by the king's squares alone
+        frm, to, promotion = position.parse_san(san)
+        if '-' not in san and \
+           scanner.tiles != [square_name(frm), square_name(to)]:
+            print('%s: baseline reads %s' % (san, '-'.join(scanner.tiles)))
+            differ += 1
+    n = max(1, len(pairs) * rounds)
+    print('%d moves: attack tables %.1f us/move, baseline %.1f us/move '
+          '(%.1fx), %d read differently' %
+          (len(pairs), 1e6 * table_time / n, 1e6 * scan_time / n,
+           scan_time / max(table_time, 1e-9), differ))
+    return 0
+
+
+def main(argv):
+    if len(argv) < 3:
+        print('usage: %s TRANSCRIPT BASELINE [rounds]' % (argv[0]))
+        return 2
+    return san_benchmark(argv[1], argv[2],
+                         int(argv[3]) if len(argv) > 3 else 100)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+''' OutputParser on replies captured from gnuchess 5.08 '''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from engine import EngineSession, OutputParser, parse_output, robot_move, \
+    search_result, result_output, MOVE, ILLEGAL, BOARD, GAME, RESULT, VARIATION
+
+# 'easy', 'post', 'depth 1' and 'go' from the starting position
+SEARCH = (
+    b'White (1) : Thinking...\nRoot = 0, Phase = 1 Depth = 1\n'
+    b'Ply   Time     Eval      Nodes   Principal-Variation\n'
+    b'\r 1.          1/20       Nf3    \r 1.          2/20        e4    '
+    b'\r 1.          3/20        f4    \r 1.         20/20        a3    '
+    b'\r 1.   0.00     72        20\t e4\n\n'
+    b'Time = 0.0 Rate=67340 Nodes=[20/0/20] GenCnt=40\n'
+    b'Eval=[22/22] RptCnt=0 NullCut=0 FutlCut=0\n'
+    b'Ext: Chk=0 Recap=0 Pawn=0 OneRep=0 Horz=0 Mate=0 KThrt=0\n'
+    b'Material=[3600/3600 : 4400/4400] Lazy=[150/150] '
+    b'MaxPosnScore=[150/150]\n'
+    b'Hash: Success=0% Collision=0% Pawn=48%\n\n'
+    b'black  KQkq  e3\n'
+    b'r n b q k b n r \np p p p p p p p \n. . . . . . . . \n'
+    b'. . . . . . . . \n. . . . P . . . \n. . . . . . . . \n'
+    b'P P P P . P P P \nR N B Q K B N R \n\n\n'
+    b'My move is : e4\nBlack (1) : Black (1) : ')
+AFTER_E4 = 'rnbqkbnr' + 'p' * 8 + '.' * 20 + 'P' + '.' * 11 + \
+    'PPPP.PPP' + 'RNBQKBNR'
+# A deeper search, Black to move: the scores are Black's
+VARIATIONS = (
+    b'\r 4.   0.00     10        84\t d5 exd5 Qxd5 Nc3\n'
+    b'\r 5.          1/20        d5    '
+    b'\r 5.   0.00    -74      2153\t e4 Nc6 Nc3\n')
+GAME_RECORD = (
+    b'White (7) :       White   Black\n  1.  e4      e5     \n'
+    b'  2.  Nc3     Nc6    \n  3.  Nf3     Nf6    \n'
+    b'  4.  d4      Bb4    \n  5.  Bg5     Bxc3+  \n'
+    b'  6.  bxc3    d6     \n\nWhite (7) : ')
+ILLEGAL_REPLY = b'White (2) : Illegal move: Ke3\nWhite (2) : '
+# gnuchess mating after 1. f3 e5 2. g4; the mate score is not a number
+MATE = (
+    b'Black (2) : Thinking...\n'
+    b'\r 1.         16/30      Qh4#    \r 1.   0.00  Mat01        16\t Qh4#'
+    b'\n\nwhite  KQkq\n'
+    b'r n b . k b n r \np p p p . p p p \n. . . . . . . . \n'
+    b'. . . . p . . . \n. . . . . . P q \n. . . . . P . . \n'
+    b'P P P P P . . P \nR N B Q K B N R \n\n\n'
+    b'My move is : Qh4#\n0-1 {computer wins as black}\n'
+    b'White (3) : White (3) : ')
+
+
+class OutputParserTest(unittest.TestCase):
+
+    def test_search(self):
+        self.assertEqual(parse_output(SEARCH),
+                         [(VARIATION, (1, 72, 20, ['e4'])),
+                          (BOARD, AFTER_E4),
+                          (MOVE, 'e4')])
+        self.assertEqual(robot_move(parse_output(SEARCH)), 'e4')
+
+    def test_variations(self):
+        # Only completed lines count, not the progress overwritten by \r
+        self.assertEqual(parse_output(VARIATIONS),
+                         [(VARIATION, (4, 10, 84, ['d5', 'exd5', 'Qxd5',
+                                                   'Nc3'])),
+                          (VARIATION, (5, -74, 2153, ['e4', 'Nc6',
+                                                      'Nc3']))])
+
+    def test_game(self):
+        self.assertEqual(parse_output(GAME_RECORD), [
+            (GAME, 'White   Black\n'
+                   '  1.  e4      e5\n  2.  Nc3     Nc6\n'
+                   '  3.  Nf3     Nf6\n  4.  d4      Bb4\n'
+                   '  5.  Bg5     Bxc3+\n  6.  bxc3    d6')])
+
+    def test_illegal(self):
+        # The reply follows a prompt on the same line
+        self.assertEqual(parse_output(ILLEGAL_REPLY), [(ILLEGAL, 'Ke3')])
+        self.assertEqual(robot_move(parse_output(ILLEGAL_REPLY)), None)
+
+    def test_result(self):
+        events = parse_output(MATE)
+        self.assertEqual(events[1:], [(MOVE, 'Qh4#'),
+                                      (RESULT, ('0-1',
+                                                'computer wins as black'))])
+        self.assertEqual(events[0][0], BOARD)
+        self.assertEqual(search_result(events), events[1:])
+        self.assertEqual(result_output(search_result(events)),
+                         b'My move is : Qh4#\n'
+                         b'0-1 {computer wins as black}\n')
+        self.assertEqual(parse_output(result_output(events)), events[1:])
+
+    def test_split_reads(self):
+        # Replies arrive in reads of any size, split anywhere
+        whole = parse_output(SEARCH + ILLEGAL_REPLY + GAME_RECORD)
+        self.assertEqual(whole, parse_output(SEARCH) +
+                         [(ILLEGAL, 'Ke3')] + parse_output(GAME_RECORD))
+        for size in [1, 2, 7, 64, 4096]:
+            data = SEARCH + ILLEGAL_REPLY + GAME_RECORD
+            parser = OutputParser()
+            events = []
+            for i in range(0, len(data), size):
+                events += parser.feed(data[i:i + size])
+            events += parser.close()
+            self.assertEqual(events, whole)
+            self.assertEqual(parser.events, whole)
+
+    def test_events_as_they_complete(self):
+        parser = OutputParser()
+        i = SEARCH.index(b'My move is')
+        self.assertEqual(parser.feed(SEARCH[:i]),
+                         [(VARIATION, (1, 72, 20, ['e4'])),
+                          (BOARD, AFTER_E4)])
+        self.assertEqual(parser.feed(SEARCH[i:]), [(MOVE, 'e4')])
+        self.assertEqual(parser.close(), [])
+
+
+
+class _Process():
+    ''' Stands in for gnuchess: its output is whatever the test writes
+    to a pipe, and what it is sent goes nowhere '''
+
+    def __init__(self):
+        read, self.output = os.pipe()
+        self.stdout = os.fdopen(read, 'rb', buffering=0)
+        self.stdin = open(os.devnull, 'wb')
+
+    def poll(self):
+        return None
+
+    def close(self):
+        self.stdout.close()
+        self.stdin.close()
+        os.close(self.output)
+
+
+class EngineSessionTest(unittest.TestCase):
+
+    def test_replies_split_anywhere(self):
+        # Each request's parser is fed its reply as it arrives, up to
+        # the pong that ends it, which may itself come in pieces.
+        data = SEARCH + b'pong 1\n' + ILLEGAL_REPLY + b'pong 2\n'
+        for size in [1, 2, 5, 64, 4096]:
+            session = EngineSession('gnuchess')
+            process = _Process()
+            session._process = process
+            replies = []
+            session._send('go', lambda events: replies.append(events))
+            session._send('Ke3', lambda events: replies.append(events))
+            for i in range(0, len(data), size):
+                os.write(process.output, data[i:i + size])
+                session._read()
+            self.assertEqual(replies, [parse_output(SEARCH),
+                                       [(ILLEGAL, 'Ke3')]])
+            self.assertTrue(session.is_idle())
+            session._process = None
+            process.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+''' Recorded gnuchess sessions, played back by the stub engine '''
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+import transcript
+from board import Board
+
+SELFPLAY = os.path.join(TESTS, 'selfplay.transcript')
+# transcript.GAME_SCRIPT played against gnuchess by 'transcript.py game'
+GAME = os.path.join(TESTS, 'game.transcript')
+
+
+class TranscriptTest(unittest.TestCase):
+
+    def test_replies_read_as_expected(self):
+        ''' Every reply served by the stub engine is read as it was when
+        the events were checked by hand '''
+        self.assertEqual(transcript.check(SELFPLAY), 0)
+
+    def test_game_logic(self):
+        ''' GameController, replaying the recorded game, plays the same
+        moves, tells the view what it told it then and keeps the board
+        in step with the game '''
+        game, told = transcript.play_game(transcript.stub_command(GAME))
+        moves = ['e4', 'e5', 'Nf3', 'Nc6', 'd4', 'Nf6']
+        self.assertEqual(game.move_list, moves)
+        self.assertEqual(game.copy_game(),
+                         'White   Black\n  1.  e4      e5\n'
+                         '  2.  Nf3     Nc6\n  3.  d4      Nf6')
+        game.close()
+        self.assertEqual([(event, value) for event, value in told
+                          if event != 'position'],
+                         [('moved', 'e4'), ('moved', 'e5'),
+                          ('moved', 'Nf3'), ('moved', 'Nc6'),
+                          ('hint', 'Nc3'), ('illegal', 'Ke3'),
+                          ('moved', 'Bc4'), ('moved', 'Nf6'),
+                          ('moved', 'd4'), ('moved', 'Nf6')])
+        # The board on a new game, after each move and after the take back
+        played = [[], moves[:1], moves[:2], moves[:3], moves[:4],
+                  moves[:4] + ['Bc4'], moves[:4] + ['Bc4', 'Nf6'],
+                  moves[:4], moves[:5], moves]
+        positions = [value for event, value in told if event == 'position']
+        self.assertEqual(len(positions), len(played))
+        for squares, move_list in zip(positions, played):
+            board = Board()
+            board.sync(move_list)
+            self.assertEqual(squares, board.squares)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -133,6 +133,7 @@ def toggle_factory(icon_name, callback, toolbar, tooltip=None):
     else:  # or a secondary toolbar
         toolbar.props.page.insert(t_button, -1)
     t_button.show()
+    return t_button
 
 def separator_factory(toolbar, expand=False, visible=True):
     ''' add a separator to a toolbar '''
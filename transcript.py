@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Suite 500 Boston, MA 02110-1335 USA
+
+'''
+transcript.py records what is said to gnuchess and what it answers,
+and plays it back, so the code that reads gnuchess output can be run
+and timed without the activity or a gnuchess binary.
+
+A transcript has one JSON object per line: the commands of a request
+("in", without the ping that ends it), the reply ("out") and how long
+gnuchess took over it ("seconds"). Set GNUCHESS_TRANSCRIPT to a file
+name to have the activity record one.
+
+What the parser should read from each reply is kept beside a transcript,
+in FILE.events: a JSON list with the events of each exchange in turn.
+It is written once, checked by hand, and committed along with the
+transcript; tests/ has one.
+
+    python3 transcript.py record FILE [plies]
+        play gnuchess against itself, recording FILE
+    python3 transcript.py game FILE
+        play GAME_SCRIPT through the game logic, recording FILE
+    python3 transcript.py expect FILE
+        write FILE.events from what the parser reads today
+    python3 transcript.py serve FILE [--realtime]
+        act as gnuchess, answering from FILE (the stub engine)
+    python3 transcript.py check FILE
+        send the recorded requests to the stub engine and compare
+        what is read from the replies with FILE.events
+    python3 transcript.py bench FILE [rounds]
+        time parsing the replies and following the game on a board
+
+sanbench.py times decoding the moves of a transcript against an older
+decoder.
+'''
+
+import json
+import os
+import signal
+import sys
+import time
+
+from engine import EngineSession, parse_output, robot_move, find_binary, \
+    MOVE, ILLEGAL, GAME, PING
+from movegen import Position
+from game import GameController, Settings, ROBOT, HINT, UNDO
+
+import logging
+_logger = logging.getLogger('GNUChessActivity')
+
+
+class Transcript():
+    ''' Appends exchanges with gnuchess to a file '''
+
+    def __init__(self, path):
+        self._fd = open(path, 'a')
+
+    def record(self, cmd, output, seconds):
+        self._fd.write(json.dumps({'in': cmd.rstrip('\n'),
+                                   'out': output.decode('latin-1'),
+                                   'seconds': round(seconds, 3)}) + '\n')
+        self._fd.flush()
+
+    def close(self):
+        self._fd.close()
+
+
+def load(path):
+    ''' The exchanges in a transcript, in order '''
+    exchanges = []
+    with open(path) as fd:
+        for line in fd:
+            if line.strip() != '':
+                exchanges.append(json.loads(line))
+    return exchanges
+
+
+def stub_command(path, realtime=False):
+    ''' The command line that runs the stub engine, for EngineSession '''
+    cmd = [sys.executable, os.path.abspath(__file__), 'serve',
+           os.path.abspath(path)]
+    if realtime:
+        cmd.append('--realtime')
+    return cmd
+
+
+def serve(path, realtime=False, stdin=sys.stdin, stdout=sys.stdout):
+    ''' Answer requests as they were answered in the transcript. Each
+    request is matched by its commands; a request made more than once
+    gets the recorded replies in turn, and then the last one again. A
+    request never recorded gets an empty reply. '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # replies are at once
+    replies = {}
+    for exchange in load(path):
+        replies.setdefault(exchange['in'], []).append(exchange)
+    ping = PING.split()[0]
+    lines = []
+    for line in stdin:
+        line = line.rstrip('\n')
+        if line == 'quit':
+            break
+        if not line.startswith(ping + ' '):
+            lines.append(line)
+            continue
+        cmd = '\n'.join(lines)
+        lines = []
+        if cmd in replies:
+            exchange = replies[cmd][0]
+            if len(replies[cmd]) > 1:
+                replies[cmd].pop(0)
+            if realtime:
+                time.sleep(exchange['seconds'])
+            stdout.write(exchange['out'])
+        else:
+            sys.stderr.write('no reply recorded for %r\n' % (cmd))
+        stdout.write('pong %s\n' % (line.split()[1]))
+        stdout.flush()
+
+
+def record(path, plies=40, binary=None):
+    ''' Let gnuchess play itself at depth 1, posting its variations,
+    and then lose a fool's mate with an illegal move on the way, so
+    that every kind of event is recorded '''
+    transcript = Transcript(path)
+    session = EngineSession(binary or find_binary(), transcript=transcript)
+    session.start()
+    session.command('easy\npost\nbook off\ndepth 1')
+    for ply in range(plies):
+        if robot_move(session.think('')) is None:
+            break
+        session.command('show board')
+    session.game()
+    session.sync([])
+    for move in ['f3', 'e5', 'Ke3', 'g4']:
+        session.play(move)
+    session.think('')  # Qh4#
+    session.close()
+    transcript.close()
+
+
+# A game played through GameController as the activity plays it: the
+# human's moves (one of them illegal), with a hint, a take back and the
+# robot's replies between them
+GAME_SCRIPT = ['e4', ROBOT, 'Nf3', ROBOT, HINT, 'Ke3', 'Bc4', ROBOT, UNDO,
+               'd4', ROBOT]
+# What the game logic tells the view about
+GAME_EVENTS = ['moved', 'illegal', 'hint', 'status', 'position']
+
+
+def play_game(binary, transcript=None):
+    ''' Play GAME_SCRIPT against the Novice robot, with gnuchess or the
+    stub engine; return the GameController and what it told the view,
+    as (event, value) pairs '''
+    game = GameController(binary, Settings(strength=0), engines=1,
+                          transcript=transcript)
+    told = []
+    for event in GAME_EVENTS:
+        # A position is the board's own list, so it is copied.
+        game.connect(event, lambda value, event=event:
+                     told.append((event, value[:] if event == 'position'
+                                  else value)))
+    game.new_game()
+    for step in GAME_SCRIPT:
+        if step == ROBOT:
+            game.start_thinking()
+            game.robot_move()
+        elif step == HINT:
+            game.hint()
+        elif step == UNDO:
+            game.undo()
+        else:
+            game.move(step)
+    return game, told
+
+
+def record_game(path, binary=None):
+    ''' Record GAME_SCRIPT played against gnuchess '''
+    transcript = Transcript(path)
+    game, told = play_game(binary or find_binary(), transcript)
+    print('%s\n%s' % (' '.join(game.move_list), game.copy_game()))
+    game.close()
+    transcript.close()
+
+
+def _json(events):
+    ''' Events as they are kept in JSON '''
+    return json.loads(json.dumps(events))
+
+
+def expect(path):
+    ''' Write what the parser reads from each recorded reply to
+    path.events, to be checked by hand and kept '''
+    with open(path + '.events', 'w') as fd:
+        json.dump([_json(parse_output(exchange['out'].encode('latin-1')))
+                   for exchange in load(path)], fd, indent=1)
+        fd.write('\n')
+
+
+def check(path):
+    ''' Send the recorded requests to the stub engine; return the
+    number of replies whose events differ from those in path.events '''
+    exchanges = load(path)
+    with open(path + '.events') as fd:
+        expected = json.load(fd)
+    if len(expected) != len(exchanges):
+        raise ValueError('%s.events has %d replies, %s has %d' %
+                         (path, len(expected), path, len(exchanges)))
+    session = EngineSession(stub_command(path))
+    session.start()
+    failed = 0
+    for exchange, events in zip(exchanges, expected):
+        if exchange['in'] == 'force manual':  # sent by start()
+            read = parse_output(exchange['out'].encode('latin-1'))
+        else:
+            read = session.command(exchange['in'])
+        if _json(read) != events:
+            print('differs: %r' % (exchange['in']))
+            failed += 1
+    session.close()
+    print('%d requests, %d differ' % (len(exchanges), failed))
+    return failed
+
+
+def _play(position, san):
+    return position.play(position.legal_move(*position.parse_san(san)))
+
+
+def decoded_moves(exchanges):
+    ''' The (position, san) pairs the activity decodes in a transcript:
+    each move gnuchess replies with, in the position it was played from,
+    and each move of the game records it prints. The game is followed
+    through the moves, 'new', 'remove' and 'undo' sent to gnuchess. '''
+    pairs = []
+    history = [Position()]
+    for exchange in exchanges:
+        events = parse_output(exchange['out'].encode('latin-1'))
+        illegal = [value for kind, value in events if kind == ILLEGAL]
+        for cmd in exchange['in'].split('\n'):
+            if cmd == 'new':
+                history = [Position()]
+            elif cmd in ['remove', 'undo']:
+                back = 2 if cmd == 'remove' else 1
+                history = history[:max(1, len(history) - back)]
+            elif cmd not in illegal:
+                try:
+                    history.append(_play(history[-1], cmd))
+                except ValueError:
+                    pass  # not a move: go, show board...
+        for kind, value in events:
+            if kind == MOVE:
+                pairs.append((history[-1], value))
+                history.append(_play(history[-1], value))
+            elif kind == GAME:
+                position = Position()
+                for line in value.split('\n')[1:]:
+                    for san in line.split()[1:]:
+                        pairs.append((position, san))
+                        position = _play(position, san)
+    return pairs
+
+
+def bench(path, rounds=100):
+    ''' Time reading the replies in a transcript and following the
+    game they describe '''
+    outputs = [exchange['out'].encode('latin-1')
+               for exchange in load(path)]
+    start = time.time()
+    events = 0
+    for i in range(rounds):
+        for output in outputs:
+            events += len(parse_output(output))
+    parse_time = time.time() - start
+    size = sum([len(output) for output in outputs]) * rounds
+    print('parse: %d replies, %d events in %.3fs, %.1f MB/s' %
+          (len(outputs) * rounds, events, parse_time,
+           size / max(parse_time, 1e-9) / 1e6))
+
+    pairs = decoded_moves(load(path))
+    start = time.time()
+    for i in range(rounds):
+        for position, san in pairs:
+            _play(position, san)
+    san_time = time.time() - start
+    n = max(1, len(pairs) * rounds)
+    print('moves: %d decoded and played, %.1f us/move' %
+          (n, 1e6 * san_time / n))
+    return 0
+
+
+def main(argv):
+    if len(argv) > 2 and argv[1] == 'serve':
+        serve(argv[2], realtime='--realtime' in argv)
+        return 0
+    if len(argv) > 2 and argv[1] == 'record':
+        record(argv[2], int(argv[3]) if len(argv) > 3 else 40)
+        return 0
+    if len(argv) > 2 and argv[1] == 'game':
+        record_game(argv[2])
+        return 0
+    if len(argv) > 2 and argv[1] == 'expect':
+        expect(argv[2])
+        return 0
+    if len(argv) > 2 and argv[1] == 'check':
+        return 1 if check(argv[2]) else 0
+    if len(argv) > 2 and argv[1] == 'bench':
+        return bench(argv[2], int(argv[3]) if len(argv) > 3 else 100)
+    print('usage: %s record|game|expect|serve|check|bench FILE' %
+          (argv[0]))
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))